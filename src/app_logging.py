@@ -0,0 +1,72 @@
+"""
+Logging setup for the backend.
+
+Modules log through `logging.getLogger(__name__)` with %-style arguments so
+nothing is formatted unless the record is emitted. Per-record diagnostics go
+through a Sampler (only every Nth record is logged at DEBUG) and every
+pipeline run ends with one RunStats summary record at INFO.
+
+Environment:
+    LOG_LEVEL        root level for the app loggers (default INFO)
+    LOG_SAMPLE_EVERY log one in N per-record debug messages (default 1000)
+"""
+import logging
+import os
+import time
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "1000"))
+
+_configured = False
+
+
+def configure_logging(level=None):
+    """Install a single stream handler on the root logger (idempotent)."""
+    global _configured
+    if _configured:
+        return
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
+    _configured = True
+
+
+class Sampler:
+    """
+    Decides which per-record messages get logged: the first one and then one
+    in every N. When the logger is not enabled for `level`, `hit()` is a
+    single attribute check.
+    """
+
+    def __init__(self, logger, level=logging.DEBUG, every=None):
+        self.enabled = logger.isEnabledFor(level)
+        self.every = max(1, every or LOG_SAMPLE_EVERY)
+        self.count = 0
+
+    def hit(self):
+        if not self.enabled:
+            return False
+        self.count += 1
+        return self.count % self.every == 1 or self.every == 1
+
+
+class RunStats:
+    """Counters for one pipeline run, logged as a single summary record."""
+
+    __slots__ = ("name", "rows_processed", "rows_skipped", "errors", "started")
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_processed = 0
+        self.rows_skipped = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    def log(self, logger, level=logging.INFO, **extra):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        details = "".join(f" {key}=%s" for key in extra)
+        logger.log(
+            level,
+            "%s finished: processed=%d skipped=%d errors=%d duration_ms=%.1f" + details,
+            self.name, self.rows_processed, self.rows_skipped, self.errors, elapsed_ms,
+            *extra.values(),
+        )
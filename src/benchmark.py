@@ -0,0 +1,1574 @@
+"""
+Benchmarks for the backend pipeline.
+
+Runs against a throwaway SQLite database unless DATABASE_URL is set, e.g.
+
+    python benchmark.py ingest --rows 10000 100000 1000000
+
+The pipeline benchmark keeps a JSON baseline and fails on regressions:
+
+    python benchmark.py pipeline --save baseline.json
+    python benchmark.py pipeline --baseline baseline.json
+
+Baselines of SQLite and PostgreSQL are committed under tests/data
+(pipeline_baseline_<dialect>.json); tests/test_pipeline_baseline.py fails
+when the pipeline runs more statements than they record.
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from typing import Optional
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from sqlalchemy import event, func, select, update
+
+_tmpdir = tempfile.mkdtemp(prefix="dolbix-bench-")
+# Generous busy timeout: the load benchmark has concurrent writers on one SQLite file
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}?timeout=60")
+# Per-run summaries and sampled warnings would interleave with the results
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+import app  # noqa: E402  (DATABASE_URL must be set before the engine is created)
+import dates  # noqa: E402
+import dbmetrics  # noqa: E402
+import dedup  # noqa: E402
+from report import FISCAL_MONTHS, ReportRow  # noqa: E402
+
+
+# ------------------------
+# Synthetic data
+# ------------------------
+
+PHASES = ["SA", "A", "B", "C", "D", "E", "F"]
+
+
+def synthetic_crm_records(n, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        start_month = rnd.randint(1, 12)
+        yield app.CRMProjectRawModel(**{
+            "No": i + 1,
+            "status": "Active",
+            "Phase": rnd.choice(PHASES),
+            "Company Name": f"Company {i % 500}",
+            "Department Name": f"Dept {i % 20}",
+            "Project name": f"Project {i}",
+            "Project Manager": "PM",
+            "PM": "PM",
+            "Order amount (gross)": rnd.randint(1, 100),
+            "Order amount (net)": rnd.randint(1, 100),
+            "Contract start date": f"{start_month:02d}/01/24",
+            "Contract End Date": f"{start_month:02d}/28/25",
+            "Billing method (number of times)": rnd.randint(1, 12),
+            "unit": "JPY",
+            "high potential mark": rnd.choice(["〇", ""]),
+        })
+
+
+def synthetic_erp_records(n, seed=0):
+    rnd = random.Random(seed)
+    records = [
+        {
+            "JOB No.": str(i + 1),
+            "Client Code": f"C{i % 500:04d}",
+            "Client name": f"Company {i % 500}",
+            "Project name": f"Project {i}",
+            "Sales posting date": f"24/{rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}",
+            "progress": "Done",
+            "Sales amount": f"{rnd.randint(1000, 900000):,}",
+            "Operating profit": f"{rnd.randint(100, 90000):,}",
+        }
+        for i in range(n)
+    ]
+    yield from app.records_adapter(app.ERPSalesRecord).validate_python(records)
+
+
+def synthetic_datacode_records(n, seed=0):
+    rnd = random.Random(seed)
+    for i in range(n):
+        yield app.DataCodeMappingModel(**{
+            "Customer Name": f"Company {i % 500}",
+            "Department Name": f"Dept {i % 20}",
+            "Parent Code": f"P{rnd.randint(1, 999):03d}",
+            "Project name": f"Project {i}",
+        })
+
+
+def synthetic_report_inputs(n, seed=0):
+    """
+    Rows shaped like the dicts generate_performance_report_endpoint passes to
+    create_performance_report: n ERP jobs, n CRM projects and n DataCode rows.
+    """
+    rnd = random.Random(seed)
+    zac_data, kintone_data, datacode_data = [], [], []
+    for i in range(n):
+        start = datetime.date(2024, rnd.randint(1, 12), 1)
+        zac_data.append({
+            "job_no": i + 1,
+            "client_code": f"C{i % 500:04d}",
+            "client_name": f"Company {i % 500}",
+            "project_name": f"Project {i}",
+            "sales_amount": float(rnd.randint(1000, 900000)),
+            "operating_profit": float(rnd.randint(100, 90000)),
+            "sales_date": datetime.date(2024, rnd.randint(1, 12), rnd.randint(1, 28)),
+            "progress_status": "Done",
+        })
+        kintone_data.append({
+            "project_id": n + i + 1,
+            "company_name": f"Company {i % 500}",
+            "department": f"Dept {i % 20}",
+            "project_name": f"Project {n + i}",
+            "phase": rnd.choice(PHASES),
+            "status": "Active",
+            "order_amount_net": float(rnd.randint(1, 100)),
+            "contract_start_date": start,
+            "contract_end_date": start.replace(year=2025),
+            "billing_method": rnd.randint(1, 12),
+            "high_potential_mark": rnd.random() < 0.5,
+        })
+        datacode_data.append({
+            "customer_name": f"Company {i % 500}",
+            "department_name": f"Dept {i % 20}",
+            "parent_code": f"P{rnd.randint(1, 999):03d}",
+            "project_name": f"Project {rnd.randrange(2 * n)}",
+        })
+    return zac_data, datacode_data, kintone_data
+
+
+# ------------------------
+# Benchmarks
+# ------------------------
+
+INGEST_TARGETS = {
+    "crm": (synthetic_crm_records, app.crm_raw_rows, app.CRMProjectRaw, app.CRM_RAW_COLUMNS, "CRM"),
+    "erp": (synthetic_erp_records, app.erp_raw_rows, app.ERPSalesRaw, app.ERP_RAW_COLUMNS, "ERP_Sales"),
+    "datacode": (synthetic_datacode_records, app.datacode_raw_rows, app.DataCodeRaw, app.DATACODE_RAW_COLUMNS, "DataCode"),
+}
+
+
+def bench_ingest(args):
+    generate, build_rows, model, columns, upload_type = INGEST_TARGETS[args.kind]
+    print(f"{'rows':>10} {'seconds':>9} {'rows/sec':>12} {'peak MiB':>9}")
+    for n in args.rows:
+        db = app.SessionLocal()
+        try:
+            upload = app.create_upload(db, upload_type, f"bench-{n}.xlsx")
+            tracemalloc.start()
+            started = time.perf_counter()
+            written = app.bulk_insert(
+                db, model.__table__, build_rows(generate(n), upload), columns, args.batch_size
+            )
+            db.commit()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            db.close()
+        print(f"{written:>10} {elapsed:>9.2f} {written / elapsed:>12,.0f} {peak / 2**20:>9.1f}")
+
+
+def write_erp_csv(path, n, seed=0):
+    """ERP export with the same column aliases as the JSON upload (no title rows)."""
+    rnd = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["JOB No.", "Client Code", "Client name", "Project name", "Sales posting date",
+                         "progress", "Sales amount", "Operating profit"])
+        for i in range(n):
+            writer.writerow([
+                i + 1, f"C{i % 500:04d}", f"Company {i % 500}", f"Project {i}",
+                f"24/{rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}", "Done",
+                f"{rnd.randint(1000, 900000):,}", f"{rnd.randint(100, 90000):,}",
+            ])
+
+
+def bench_upload(args):
+    """JSON body upload vs streamed multipart CSV upload, through the HTTP layer."""
+    from fastapi.testclient import TestClient
+
+    client = TestClient(app.app)
+    print(f"{'path':>10} {'rows':>10} {'seconds':>9} {'rows/sec':>12} {'peak MiB':>9}")
+    for n in args.rows:
+        path = os.path.join(_tmpdir, f"erp-{n}.csv")
+        write_erp_csv(path, n)
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(path, newline="", encoding="utf-8") as f:
+            records = [{k: v for k, v in row.items() if v} for row in csv.DictReader(f)]
+        response = client.post("/api/upload/erp/sales", json={"file_name": path, "month": "April", "records": records})
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del records
+        response.raise_for_status()
+        print(f"{'json':>10} {n:>10} {elapsed:>9.2f} {n / elapsed:>12,.0f} {peak / 2**20:>9.1f}")
+
+        # Different rows for the same jobs, so the second upload is not a re-upload of the first
+        path = os.path.join(_tmpdir, f"erp-{n}-file.csv")
+        write_erp_csv(path, n, seed=1)
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            response = client.post("/api/upload/file/erp_sales", files={"file": ("erp.csv", f, "text/csv")},
+                                   data={"skip_rows": "0"})
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        response.raise_for_status()
+        print(f"{'multipart':>10} {response.json()['rows']:>10} {elapsed:>9.2f} {n / elapsed:>12,.0f} {peak / 2**20:>9.1f}")
+
+
+@contextlib.contextmanager
+def count_statements(engine):
+    """Count SQL statements sent to the database inside the block."""
+    counter = {"statements": 0}
+
+    def before_cursor_execute(*_):
+        counter["statements"] += 1
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed_raw(n, uploads):
+    """Seed `uploads` CRM and ERP uploads of n rows each over the same keys."""
+    db = app.SessionLocal()
+    try:
+        for u in range(uploads):
+            for kind in ("crm", "erp"):
+                generate, build_rows, model, columns, upload_type = INGEST_TARGETS[kind]
+                upload = app.create_upload(db, upload_type, f"seed-{u}.xlsx")
+                app.bulk_insert(db, model.__table__, build_rows(generate(n, seed=u), upload), columns)
+                db.commit()
+    finally:
+        db.close()
+
+
+def reset_tables(*models):
+    db = app.SessionLocal()
+    try:
+        for model in models:
+            db.query(model).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def legacy_consolidate(db):
+    """
+    The original per-row consolidation loop (one SELECT per raw row), kept as
+    the baseline. Autoflush is turned on so a key repeated across uploads finds
+    its pending final row; the original loop raised IntegrityError there.
+    """
+    db.autoflush = True
+    for rec in db.query(app.CRMProjectRaw).all():
+        final = db.query(app.CRMProjectFinal).filter(app.CRMProjectFinal.project_id == rec.project_id).first()
+        if final is None:
+            final = app.CRMProjectFinal(project_id=rec.project_id)
+            db.add(final)
+        for column in app.CRM_FINAL_COLUMNS:
+            setattr(final, column, getattr(rec, column))
+    for rec in db.query(app.ERPSalesRaw).all():
+        final = db.query(app.ERPSalesFinal).filter(app.ERPSalesFinal.job_no == rec.job_no).first()
+        if final is None:
+            final = app.ERPSalesFinal(job_no=rec.job_no)
+            db.add(final)
+        for column in app.ERP_FINAL_COLUMNS:
+            setattr(final, column, getattr(rec, column))
+    db.commit()
+
+
+def snapshot_finals():
+    db = app.SessionLocal()
+    try:
+        crm = {r.project_id: tuple(getattr(r, c) for c in app.CRM_FINAL_COLUMNS) for r in db.query(app.CRMProjectFinal)}
+        erp = {r.job_no: tuple(getattr(r, c) for c in app.ERP_FINAL_COLUMNS) for r in db.query(app.ERPSalesFinal)}
+        return crm, erp
+    finally:
+        db.close()
+
+
+def consolidate(db, full_rebuild=True):
+    """What /api/consolidate runs, on a sync session."""
+    result = app.consolidate_all(db, full_rebuild)
+    db.commit()
+    return result
+
+
+def bench_consolidate(args):
+    reset_tables(
+        app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.CRMProjectFinal, app.ERPSalesFinal, app.MonthlyUpload
+    )
+    seed_raw(args.rows, args.uploads)
+    print(f"seeded {args.uploads} uploads x {args.rows} rows for CRM and ERP")
+    print(f"{'engine':>10} {'seconds':>9} {'statements':>11}")
+    results = {}
+    engines = (
+        ("legacy", legacy_consolidate),
+        ("set-based", consolidate),
+    )
+    for name, run in engines:
+        reset_tables(app.CRMProjectFinal, app.ERPSalesFinal)
+        db = app.SessionLocal()
+        try:
+            with count_statements(app.engine) as counter:
+                started = time.perf_counter()
+                run(db)
+                elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+        results[name] = snapshot_finals()
+        print(f"{name:>10} {elapsed:>9.2f} {counter['statements']:>11}")
+    if results["legacy"] != results["set-based"]:
+        raise SystemExit("set-based consolidation does not match the legacy loop")
+    print("final tables identical")
+
+    # One more monthly upload: incremental run vs rebuilding from the full history
+    saved = consolidated_uploads()
+    seed_raw(args.rows, 1)
+    for name, full_rebuild in (("full", True), ("increment", False)):
+        if not full_rebuild:
+            consolidated_uploads(saved)
+        db = app.SessionLocal()
+        try:
+            with count_statements(app.engine) as counter:
+                started = time.perf_counter()
+                crm, _ = consolidate(db, full_rebuild)
+                elapsed = time.perf_counter() - started
+        finally:
+            db.close()
+        print(f"{name:>10} {elapsed:>9.2f} {counter['statements']:>11}  crm rows={crm['rows']}")
+
+
+def sync_app():
+    """
+    The upload and report endpoints as they were before the async rewrite:
+    sync handlers on the blocking engine, run in Starlette's threadpool.
+    """
+    from fastapi import Depends, FastAPI
+
+    legacy = FastAPI()
+
+    @legacy.post("/api/upload/datacode")
+    def upload_datacode(payload: app.DataCodeUploadPayload, db=Depends(app.get_db)):
+        result = app.ingest_records(
+            db, "DataCode", payload.file_name, payload.records,
+            app.datacode_raw_rows, app.DataCodeRaw, app.DATACODE_RAW_COLUMNS,
+        )
+        db.commit()
+        return {"upload_id": result.upload.upload_id}
+
+    @legacy.post("/api/generate_report")
+    def generate_report(engine: str = "python", refresh: bool = False, db=Depends(app.get_db)):
+        report = app.REPORT_BUILDERS[engine](db, None)
+        response = app.store_report(db, report)
+        db.commit()
+        return response
+
+    return legacy
+
+
+async def run_load(asgi_app, concurrency, requests, payload):
+    """
+    `concurrency` clients share `requests` calls, alternating a full report
+    (refresh=true, so the cache is bypassed) and a small DataCode upload.
+    Returns elapsed seconds and per-endpoint latencies.
+    """
+    import asyncio
+    import httpx
+
+    latencies = {"report": [], "upload": []}
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait("report" if i % 2 == 0 else "upload")
+
+    async def client(http):
+        while not queue.empty():
+            kind = queue.get_nowait()
+            started = time.perf_counter()
+            if kind == "report":
+                # The python engine on both apps, so they build the same report the same way
+                response = await http.post("/api/generate_report", params={"refresh": "true", "engine": "python"})
+            else:
+                response = await http.post("/api/upload/datacode", json=payload)
+            response.raise_for_status()
+            latencies[kind].append(time.perf_counter() - started)
+
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def bench_load(args):
+    import asyncio
+
+    seed_final_tables(args.projects)
+    payload = {
+        "file_name": "load.xlsx",
+        "month": "April",
+        "records": [r.model_dump(by_alias=True) for r in synthetic_datacode_records(args.upload_rows)],
+    }
+    print(f"seeded {args.projects} projects; {args.requests} requests per run, "
+          f"half reports and half {args.upload_rows}-row DataCode uploads")
+    print(f"{'endpoints':>10} {'clients':>8} {'req/sec':>9} {'upload p50':>11} {'upload p95':>11} "
+          f"{'report p50':>11} {'pool wait max':>14}")
+    for concurrency in args.concurrency:
+        # Both apps work on the sync engine: the async one from its handlers' threadpool calls
+        for name, asgi_app in (("sync", sync_app()), ("async", app.app)):
+            app.engine.pool.wait_stats = dbmetrics.WaitStats()
+            elapsed, latencies = asyncio.run(run_load(asgi_app, concurrency, args.requests, payload))
+            upload, report = latencies["upload"], latencies["report"]
+            pool_wait = app.engine.pool.wait_stats.max_seconds
+            print(
+                f"{name:>10} {concurrency:>8} {args.requests / elapsed:>9.1f} "
+                f"{_percentile(upload, 0.5) * 1000:>9.0f}ms {_percentile(upload, 0.95) * 1000:>9.0f}ms "
+                f"{_percentile(report, 0.5) * 1000:>9.0f}ms {pool_wait * 1000:>12.1f}ms"
+            )
+
+
+def consolidated_uploads(restore=None):
+    """Ids of the consolidated uploads, or mark only previously read ones consolidated again."""
+    db = app.SessionLocal()
+    try:
+        if restore is not None:
+            db.execute(
+                update(app.MonthlyUpload)
+                .where(app.MonthlyUpload.upload_id.not_in(restore))
+                .values(consolidated_at=None)
+            )
+            db.commit()
+        return set(db.execute(
+            select(app.MonthlyUpload.upload_id).where(app.MonthlyUpload.consolidated_at.isnot(None))
+        ).scalars())
+    finally:
+        db.close()
+
+
+def edge_case_report_inputs():
+    """Rows exercising the report's skip/default rules (NULLs, bad values, duplicates, long contracts)."""
+    d = datetime.date
+    zac_data = [
+        {"job_no": 0, "project_name": "Zero", "client_name": "C", "sales_date": d(2024, 4, 1), "operating_profit": 5},
+        {"job_no": None, "project_name": "None", "client_name": "C", "sales_date": None, "operating_profit": None},
+        {"job_no": 7, "project_name": "P1", "client_name": None, "sales_date": None, "operating_profit": 3},
+        {"job_no": 7, "project_name": "P1b", "client_name": "Dup", "sales_date": d(2024, 5, 2), "operating_profit": None},
+        {"job_no": 8, "project_name": "P2", "client_name": "C", "sales_date": "2024-06-01 00:00:00", "operating_profit": "12.5"},
+        {"job_no": 9, "project_name": "P3", "client_name": "C", "sales_date": "bad", "operating_profit": 1},
+        {"job_no": 10, "project_name": "P4", "client_name": "C", "sales_date": datetime.datetime(2025, 3, 3, 5), "operating_profit": 0},
+        # No project name: ranked like the last CRM project without one, parent code of the first such DataCode row
+        {"job_no": 20, "project_name": None, "client_name": "C", "sales_date": d(2024, 8, 8), "operating_profit": 4},
+    ]
+    kintone_data = [
+        {"project_id": 7, "project_name": "P1", "company_name": "X", "phase": "A1", "high_potential_mark": False,
+         "order_amount_net": 2, "billing_method": None, "contract_start_date": d(2024, 11, 1), "contract_end_date": d(2026, 2, 1)},
+        {"project_id": 11, "project_name": "P1", "company_name": "X", "phase": " sa ", "high_potential_mark": True,
+         "order_amount_net": 2, "billing_method": 3, "contract_start_date": d(2024, 1, 1), "contract_end_date": d(2024, 6, 1)},
+        {"project_id": 12, "project_name": "Q", "company_name": "Y", "phase": "b", "high_potential_mark": True,
+         "order_amount_net": 0, "billing_method": 3, "contract_start_date": d(2024, 1, 1), "contract_end_date": d(2024, 6, 1)},
+        {"project_id": 13, "project_name": "R", "company_name": "Y", "phase": "C", "high_potential_mark": True,
+         "order_amount_net": 1.5, "billing_method": 20, "contract_start_date": d(2024, 1, 1), "contract_end_date": d(2026, 6, 1)},
+        {"project_id": 14, "project_name": "S", "company_name": "Y", "phase": "Axx", "high_potential_mark": None,
+         "order_amount_net": 1, "billing_method": 0, "contract_start_date": d(2024, 9, 1), "contract_end_date": d(2024, 6, 1)},
+        {"project_id": 15, "project_name": "T", "company_name": "Y", "phase": "A", "high_potential_mark": None,
+         "order_amount_net": 1, "billing_method": 2, "contract_start_date": None, "contract_end_date": d(2024, 6, 1)},
+        {"project_id": "x", "project_name": "U", "company_name": "Y", "phase": "A", "high_potential_mark": None,
+         "order_amount_net": 1, "billing_method": 2, "contract_start_date": None, "contract_end_date": None},
+        {"project_id": 16, "project_name": "V", "company_name": "Y", "phase": None, "high_potential_mark": True,
+         "order_amount_net": 4, "billing_method": "2", "contract_start_date": "2024-02-01 00:00:00", "contract_end_date": "2024-12-01 00:00:00"},
+        {"project_id": 18, "project_name": "X", "company_name": "Y", "phase": "A", "high_potential_mark": True,
+         "order_amount_net": 4, "billing_method": 2.7, "contract_start_date": d(2024, 2, 1), "contract_end_date": d(2024, 12, 1)},
+        {"project_id": 19, "project_name": "W", "company_name": "Y", "phase": "   ", "high_potential_mark": True,
+         "order_amount_net": 2, "billing_method": 2, "contract_start_date": d(2024, 4, 1), "contract_end_date": d(2024, 9, 1)},
+        {"project_id": 21, "project_name": None, "company_name": "Y", "phase": "D", "high_potential_mark": True,
+         "order_amount_net": 1, "billing_method": 1, "contract_start_date": d(2024, 5, 1), "contract_end_date": d(2024, 7, 1)},
+        {"project_id": 22, "project_name": None, "company_name": "Y", "phase": "A", "high_potential_mark": False,
+         "order_amount_net": 3, "billing_method": 3, "contract_start_date": d(2024, 10, 1), "contract_end_date": d(2025, 9, 1)},
+    ]
+    datacode_data = [
+        {"project_name": "P1", "parent_code": "PA"},
+        {"project_name": "P1", "parent_code": "PB"},
+        {"project_name": "Q", "parent_code": None},
+        {"project_name": None, "parent_code": "N"},
+    ]
+    return zac_data, datacode_data, kintone_data
+
+
+def report_engines():
+    engines = {"python": app.create_performance_report}
+    if app.report_columnar is not None:
+        engines["columnar"] = app.report_columnar.create_performance_report_columnar
+    return engines
+
+
+# Fiscal years checked besides the all-years report; the synthetic and edge-case data span 2023-2026
+CHECK_FISCAL_YEARS = (2023, 2024, 2025)
+
+
+def check_report_equivalence(inputs, label):
+    """Golden check: every engine must return exactly the rows of the row-based engine."""
+    for fiscal_year in (None,) + CHECK_FISCAL_YEARS:
+        golden = app.create_performance_report(*inputs, fiscal_year=fiscal_year)
+        for name, build in report_engines().items():
+            rows = build(*inputs, fiscal_year=fiscal_year)
+            # repr also catches 0 vs 0.0 in untouched month cells
+            if rows != golden or repr(rows) != repr(golden):
+                raise SystemExit(f"{name} report differs from the row-based report on {label}, fiscal year {fiscal_year}")
+
+
+def bench_report(args):
+    engines = report_engines()
+    if args.verify:
+        check_report_equivalence(edge_case_report_inputs(), "edge cases")
+    print(f"{'engine':>10} {'projects':>10} {'seconds':>9} {'us/project':>11}")
+    for n in args.projects:
+        inputs = synthetic_report_inputs(n)
+        if args.verify:
+            check_report_equivalence(inputs, f"{n} synthetic projects")
+        for name in args.engines or engines:
+            started = time.perf_counter()
+            engines[name](*inputs)
+            elapsed = time.perf_counter() - started
+            # Flat us/project across sizes means report time grows linearly with input
+            print(f"{name:>10} {n:>10} {elapsed:>9.3f} {elapsed / n * 1e6:>11.1f}")
+    if args.verify:
+        print("all engines match the row-based report")
+
+
+def legacy_report_entry(project_code):
+    """Per-project dict the row-based report used to accumulate into."""
+    entry = {"Parent Code": "", "Customer Name": "", "Project Name": "", "Project Rank": "E",
+             "Project Code": project_code}
+    for month in FISCAL_MONTHS:
+        entry[month] = 0
+    entry["Net sales amount"] = 0
+    return entry
+
+
+def _traced_bytes(build):
+    """Bytes still allocated by build()'s result, and the peak while building it."""
+    tracemalloc.start()
+    try:
+        result = build()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def bench_report_memory(args):
+    """Accumulator footprint per project (month-name dicts vs ReportRow) and the report's peak memory."""
+    n = args.projects
+    codes = [f"{i:07d}" for i in range(n)]
+    legacy, _ = _traced_bytes(lambda: {code: legacy_report_entry(code) for code in codes})
+    compact, _ = _traced_bytes(lambda: {code: ReportRow("", "", "", "E", code) for code in codes})
+    print(f"accumulator for {n:,} projects")
+    print(f"  {'month-name dicts':<18} {legacy / 2**20:>8.1f} MiB  {legacy / n:>6.0f} B/project")
+    print(f"  {'ReportRow':<18} {compact / 2**20:>8.1f} MiB  {compact / n:>6.0f} B/project")
+
+    inputs = synthetic_report_inputs(n // 2)
+    started = time.perf_counter()
+    _, peak = _traced_bytes(lambda: len(app.create_performance_report(*inputs)))
+    elapsed = time.perf_counter() - started
+    print(f"create_performance_report: {n:,} input projects, peak {peak / 2**20:.1f} MiB "
+          f"(under tracemalloc: {elapsed:.2f}s)")
+
+
+def seed_final_tables(n):
+    """Fresh database with n CRM projects, n ERP jobs and n DataCode rows, consolidated."""
+    reset_tables(
+        app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.CRMProjectFinal, app.ERPSalesFinal,
+        app.MonthlyUpload, app.ConsolidationWatermark,
+    )
+    db = app.SessionLocal()
+    try:
+        for kind in ("crm", "erp", "datacode"):
+            generate, build_rows, model, columns, upload_type = INGEST_TARGETS[kind]
+            upload = app.create_upload(db, upload_type, f"seed-{kind}.xlsx")
+            app.bulk_insert(db, model.__table__, build_rows(generate(n), upload), columns)
+        db.commit()
+        consolidate(db)
+    finally:
+        db.close()
+
+
+def bench_report_db(args):
+    builders = {name: app.REPORT_BUILDERS[name] for name in args.engines or app.REPORT_ENGINES}
+    if app.report_columnar is None:
+        builders.pop("columnar", None)
+    if args.fiscal_year is not None:
+        # The aggregates only hold the all-years report
+        builders.pop("aggregate", None)
+    print(f"{'engine':>10} {'projects':>10} {'seconds':>9} {'statements':>11}")
+    for n in args.projects:
+        seed_final_tables(n)
+        golden = None
+        for name, build in builders.items():
+            db = app.SessionLocal()
+            try:
+                with count_statements(app.engine) as counter:
+                    started = time.perf_counter()
+                    rows = build(db, args.fiscal_year)
+                    elapsed = time.perf_counter() - started
+            finally:
+                db.close()
+            print(f"{name:>10} {n:>10} {elapsed:>9.3f} {counter['statements']:>11}")
+            if golden is None:
+                golden = rows
+            elif rows != golden:
+                raise SystemExit(f"{name} report differs from the {next(iter(builders))} report")
+        if args.fiscal_year is not None:
+            # The date-range filtered reads must not change the result of filtering in memory
+            db = app.SessionLocal()
+            try:
+                everything = app.load_report_rows(db)
+            finally:
+                db.close()
+            if app.create_performance_report(*everything, fiscal_year=args.fiscal_year) != golden:
+                raise SystemExit("fiscal year report differs when built from the unfiltered tables")
+
+
+# ------------------------
+# Date parsing
+# ------------------------
+
+DATE_EDGE_CASES = {
+    dates.CRM_DATE_FORMAT: ["04/30/24", "4/3/24", "12/31/68", "01/01/69", "02/29/24", "02/29/23", "13/01/24",
+                            "00/10/24", "04-30-24", "04/30/2024", " 04/30/24", "０4/30/24", ""],
+    dates.ERP_DATE_FORMAT: ["24/04/30", "24/4/3", "99/12/31", "00/01/01", "24/02/30", "24/13/01", "24/04/3x"],
+    dates.REPORT_DATETIME_FORMAT: ["2024-06-01 00:00:00", "2024-06-01 13:45:10", "2024-06-31 00:00:00",
+                                   "2024-6-1 00:00:00", "2024-06-01", "2024-06-01 24:00:00", "bad"],
+}
+
+
+def _strptime_date(text, fmt):
+    try:
+        return datetime.datetime.strptime(text, fmt).date()
+    except ValueError:
+        return ValueError
+
+
+def _cached_date(text, fmt):
+    try:
+        return dates.parse_date(text, fmt)
+    except ValueError:
+        return ValueError
+
+
+def bench_dates(args):
+    """strptime per row vs the cached fixed-width parser, on exports with few distinct dates."""
+    for fmt, cases in DATE_EDGE_CASES.items():
+        for text in cases:
+            if _cached_date(text, fmt) != _strptime_date(text, fmt):
+                raise SystemExit(f"dates.parse_date({text!r}, {fmt!r}) differs from strptime")
+
+    rnd = random.Random(0)
+    days = [datetime.date(2024, 4, 1) + datetime.timedelta(days=i) for i in range(args.distinct)]
+    picks = [rnd.choice(days) for _ in range(args.rows)]
+    print(f"{'format':<20} {'rows':>9} {'strptime s':>11} {'cached s':>9} {'speedup':>8}")
+    for fmt in (dates.CRM_DATE_FORMAT, dates.ERP_DATE_FORMAT, dates.REPORT_DATETIME_FORMAT):
+        texts = [day.strftime(fmt) for day in picks]
+        started = time.perf_counter()
+        expected = [datetime.datetime.strptime(text, fmt).date() for text in texts]
+        strptime_seconds = time.perf_counter() - started
+        dates._parse.cache_clear()
+        started = time.perf_counter()
+        parsed = [dates.parse_date(text, fmt) for text in texts]
+        cached_seconds = time.perf_counter() - started
+        if parsed != expected:
+            raise SystemExit(f"cached parse differs from strptime for {fmt!r}")
+        print(f"{fmt:<20} {len(texts):>9,} {strptime_seconds:>11.3f} {cached_seconds:>9.3f} "
+              f"{strptime_seconds / cached_seconds:>7.1f}x")
+    print(dates.cache_info())
+
+
+# ------------------------
+# Report snapshots
+# ------------------------
+
+def bench_snapshots(args):
+    """Stored size of a report as one JSON value vs compressed chunks, and page vs full read cost."""
+    import json
+    import snapshots
+
+    report = app.create_performance_report(*synthetic_report_inputs(args.projects // 2))
+    json_bytes = len(json.dumps(report).encode("utf-8"))
+    reset_tables(app.ReportSnapshotChunk, app.PerformanceReportGenerationHistory)
+    db = app.SessionLocal()
+    try:
+        history = app.store_report(db, report)
+        db.commit()
+        report_id = history["report_id"]
+        table = app.ReportSnapshotChunk.__table__
+        chunk_bytes = db.execute(select(func.sum(func.length(table.c.data)))).scalar()
+        print(f"{len(report):,} report rows")
+        print(f"  {'JSON column':<18} {json_bytes / 2**20:>8.2f} MiB")
+        print(f"  {'zlib chunks':<18} {chunk_bytes / 2**20:>8.2f} MiB  ({json_bytes / chunk_bytes:.1f}x smaller)")
+
+        matches = snapshots.row_filter(project_ranks=["A"])
+        reads = {
+            "full read": lambda: snapshots.read_page(db, table, report_id, len(report)),
+            f"page of {args.page_size}": lambda: snapshots.read_page(
+                db, table, report_id, len(report), len(report) // 2, args.page_size),
+            "rank A filter": lambda: snapshots.read_page(
+                db, table, report_id, len(report), 0, args.page_size, matches),
+        }
+        print(f"  {'read':<18} {'ms':>8} {'peak MiB':>9}")
+        for label, read in reads.items():
+            started = time.perf_counter()
+            read()
+            elapsed = time.perf_counter() - started
+            _, peak = _traced_bytes(read)
+            print(f"  {label:<18} {elapsed * 1000:>8.1f} {peak / 2**20:>9.1f}")
+        rows, total = snapshots.read_page(db, table, report_id, len(report))
+        if rows != report or total != len(report):
+            raise SystemExit("snapshot rows differ from the stored report")
+        rows, total = reads["rank A filter"]()
+        expected = [row for row in report if row["Project Rank"] == "A"]
+        if rows != expected[:args.page_size] or total != len(expected):
+            raise SystemExit("filtered snapshot page differs from filtering the report")
+    finally:
+        db.close()
+
+
+def mutated_report(report, seed=0):
+    """A later version of a report: some projects dropped, some added, some amounts and ranks changed."""
+    rng = random.Random(seed)
+    rows = []
+    for row in report:
+        roll = rng.random()
+        if roll < 0.02:
+            continue
+        row = dict(row)
+        if roll < 0.07:
+            month = rng.choice(FISCAL_MONTHS)
+            row[month] += 1000.0
+            row["Net sales amount"] += 1000.0
+        elif roll < 0.08:
+            row["Project Rank"] = "A" if row["Project Rank"] != "A" else "B"
+        rows.append(row)
+    for i in range(len(report) // 50):
+        row = dict(report[i], **{"Project Code": f"9{i:06d}"})
+        rows.append(row)
+    return rows
+
+
+def reference_diff(old_rows, new_rows):
+    """(added, removed, changed) project codes, from both reports held in full."""
+    old = {row["Project Code"]: row for row in old_rows}
+    new = {row["Project Code"]: row for row in new_rows}
+    changed = {code for code in old.keys() & new.keys() if old[code] != new[code]}
+    return new.keys() - old.keys(), old.keys() - new.keys(), changed
+
+
+def bench_compare(args):
+    """Streamed hash-join diff of two stored snapshots vs loading both in full, and the cached lookup."""
+    import snapshots
+    from report_diff import diff_reports
+
+    report = app.create_performance_report(*synthetic_report_inputs(args.projects // 2))
+    later = mutated_report(report)
+    reset_tables(app.ReportSnapshotChunk, app.PerformanceReportGenerationHistory)
+    app.comparison_cache.invalidate()
+    db = app.SessionLocal()
+    try:
+        old_id = app.store_report(db, report)["report_id"]
+        new_id = app.store_report(db, later)["report_id"]
+        db.commit()
+        table = app.ReportSnapshotChunk.__table__
+
+        def full_load():
+            old_rows, _ = snapshots.read_page(db, table, old_id, len(report))
+            new_rows, _ = snapshots.read_page(db, table, new_id, len(later))
+            return reference_diff(old_rows, new_rows)
+
+        def streamed():
+            return diff_reports(snapshots.iter_rows(db, table, old_id), snapshots.iter_rows(db, table, new_id))
+
+        print(f"{len(report):,} vs {len(later):,} report rows")
+        print(f"  {'diff':<18} {'ms':>8} {'peak MiB':>9}")
+        for label, run in (("load both, dicts", full_load), ("streamed join", streamed)):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            _, peak = _traced_bytes(run)
+            print(f"  {label:<18} {elapsed * 1000:>8.1f} {peak / 2**20:>9.1f}")
+
+        added, removed, changed = full_load()
+        diff = streamed()
+        got = (
+            {row["Project Code"] for row in diff["added"]},
+            {row["Project Code"] for row in diff["removed"]},
+            {row["Project Code"] for row in diff["changed"]},
+        )
+        if got != (added, removed, changed):
+            raise SystemExit("streamed diff differs from comparing the full reports")
+        print(f"  {len(added):,} added, {len(removed):,} removed, {len(changed):,} changed")
+    finally:
+        db.close()
+
+    from fastapi.testclient import TestClient
+
+    client = TestClient(app.app)
+    url = f"/api/compare_reports?old_report_id={old_id}&new_report_id={new_id}"
+    for label in ("endpoint, first", "endpoint, cached"):
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        print(f"  {label:<18} {elapsed * 1000:>8.1f}")
+
+
+# ------------------------
+# ERP record validation
+# ------------------------
+
+class LegacyERPSalesRawModel(BaseModel):
+    """The ERP upload schema before ERPSalesRecord: every export column, numeric validator on ten."""
+    job_no: str = Field(..., alias="JOB No.")
+    salesperson_code: Optional[str] = Field(None, alias="Salesperson Code")
+    sales_representative: Optional[str] = Field(None, alias="sales representative")
+    person_in_charge_2: Optional[str] = Field(None, alias="Person in Charge 2")
+    client_code: Optional[str] = Field(None, alias="Client Code")
+    client_name: Optional[str] = Field(None, alias="Client name")
+    project_name: Optional[str] = Field(None, alias="Project name")
+    aggregation_category_code: Optional[str] = Field(None, alias="Aggregation Category Code")
+    aggregation_category_name: Optional[str] = Field(None, alias="Aggregation Category Name")
+    sales_posting_date: Optional[str] = Field(None, alias="Sales posting date")
+    progress: Optional[str] = Field(None, alias="progress")
+    sales_amount: Optional[float] = Field(None, alias="Sales amount")
+    cost_1: Optional[float] = Field(None, alias="Cost 1")
+    gross_profit: Optional[float] = Field(None, alias="Gross profit")
+    gross_profit_margin: Optional[str] = Field(None, alias="Gross profit margin")
+    cost_2: Optional[float] = Field(None, alias="Cost 2")
+    gross_profit_alt: Optional[float] = Field(None, alias="Gross Profit")
+    sales_rate: Optional[float] = Field(None, alias="Sales rate")
+    cost_3: Optional[float] = Field(None, alias="Cost 3")
+    operating_profit: Optional[float] = Field(None, alias="Operating profit")
+    profit_rate: Optional[float] = Field(None, alias="Profit rate")
+    total_cost: Optional[float] = Field(None, alias="Total Cost")
+    project_code: Optional[str] = Field(None, alias="Project Code")
+    project_name_1: Optional[str] = Field(None, alias="Project name_1")
+    department_2nd: Optional[str] = Field(None, alias="Department (2nd level)")
+    department_3rd: Optional[str] = Field(None, alias="Department (third level)")
+    department_4th: Optional[str] = Field(None, alias="Department (4th hierarchical level)")
+    department_5th: Optional[str] = Field(None, alias="Department (5th level)")
+    department_6th: Optional[str] = Field(None, alias="Department (6th level)")
+    customer_number: Optional[str] = Field(None, alias="Customer Number")
+    customer: Optional[str] = Field(None, alias="Customer")
+    billing_code: Optional[str] = Field(None, alias="Billing Code")
+    billing_address: Optional[str] = Field(None, alias="Billing address")
+
+    # Was a v1 @validator(..., pre=True, always=True); the v2 spelling runs the same before-validator
+    @field_validator(
+        "sales_amount", "cost_1", "gross_profit", "cost_2", "gross_profit_alt",
+        "sales_rate", "cost_3", "operating_profit", "profit_rate", "total_cost",
+        mode="before",
+    )
+    def validate_numeric_fields(cls, v):
+        return app.parse_numeric(v)
+
+
+def legacy_erp_raw_row(rec):
+    """erp_raw_rows' conversions before they moved into ERPSalesRecord (upload columns left out)."""
+    sales_date = None
+    if rec.sales_posting_date:
+        sales_date = dates.parse_date(rec.sales_posting_date.strip(), dates.ERP_DATE_FORMAT)
+    return {
+        "job_no": int(rec.job_no),
+        "client_code": rec.client_code,
+        "client_name": rec.client_name,
+        "project_name": rec.project_name,
+        "sales_amount": rec.sales_amount,
+        "operating_profit": rec.operating_profit,
+        "sales_date": sales_date,
+        "progress_status": rec.progress,
+    }
+
+
+def erp_export_records(n, seed=0):
+    """ERP export rows as the frontend sends them: every column, all values as text."""
+    rnd = random.Random(seed)
+    numeric = {"Sales amount", "Cost 1", "Gross profit", "Cost 2", "Gross Profit", "Sales rate",
+               "Cost 3", "Operating profit", "Profit rate", "Total Cost"}
+    records = []
+    for i in range(n):
+        record = {}
+        for field in LegacyERPSalesRawModel.model_fields.values():
+            alias = field.alias
+            record[alias] = f"{rnd.randint(100, 900000):,}" if alias in numeric else f"{alias} {i % 97}"
+        record["JOB No."] = str(i + 1)
+        record["Sales posting date"] = f"24/{rnd.randint(1, 12):02d}/{rnd.randint(1, 28):02d}"
+        records.append(record)
+    return records
+
+
+def bench_validation(args):
+    """Rows/sec validating an ERP upload payload: full legacy model per row vs ERPSalesRecord in one pass."""
+    upload = types.SimpleNamespace(upload_id=1, upload_timestamp=None)
+    columns = dedup.hashed_columns(app.ERP_RAW_COLUMNS)
+    lean = app.records_adapter(app.ERPSalesRecord)
+    print(f"{'schema':>10} {'rows':>10} {'seconds':>9} {'rows/sec':>12}")
+    for n in args.rows:
+        records = erp_export_records(n)
+        results = {}
+        for label, validate in (
+            ("legacy", lambda: [legacy_erp_raw_row(LegacyERPSalesRawModel(**record)) for record in records]),
+            ("lean", lambda: [
+                {column: row[column] for column in columns}
+                for row in app.erp_raw_rows(lean.validate_python(records), upload)
+            ]),
+        ):
+            started = time.perf_counter()
+            results[label] = validate()
+            elapsed = time.perf_counter() - started
+            print(f"{label:>10} {n:>10} {elapsed:>9.2f} {n / elapsed:>12,.0f}")
+        if results["lean"] != results["legacy"]:
+            raise SystemExit("ERPSalesRecord rows differ from the legacy model's")
+
+    # Every invalid row is reported, not only the first
+    records = erp_export_records(1000)
+    bad = {17: "JOB No.", 400: "Sales posting date", 999: "Operating profit"}
+    for index, alias in bad.items():
+        records[index][alias] = "n/a"
+    try:
+        lean.validate_python(records)
+    except ValidationError as e:
+        reported = {error["loc"][0] for error in e.errors()}
+    else:
+        reported = set()
+    if reported != set(bad):
+        raise SystemExit(f"expected errors for rows {sorted(bad)}, got {sorted(reported)}")
+    print(f"all {len(bad)} invalid rows reported in one pass")
+
+
+# ------------------------
+# Report aggregates
+# ------------------------
+
+def changed_uploads(n, changes, seed=0):
+    """One CRM and one ERP upload touching `changes` of the n seeded projects, consolidated incrementally."""
+    rnd = random.Random(seed)
+    picked = rnd.sample(range(n), changes)
+    crm = list(synthetic_crm_records(n, seed + 1))
+    erp = list(synthetic_erp_records(n, seed + 1))
+    db = app.SessionLocal()
+    try:
+        for kind, records in (("crm", [crm[i] for i in picked]), ("erp", [erp[i] for i in picked])):
+            _, build_rows, model, columns, upload_type = INGEST_TARGETS[kind]
+            upload = app.create_upload(db, upload_type, f"changes-{kind}.xlsx")
+            app.bulk_insert(db, model.__table__, build_rows(records, upload), columns)
+        db.commit()
+    finally:
+        db.close()
+
+
+def bench_aggregates(args):
+    """
+    Incremental aggregate maintenance vs a full rebuild, the aggregate report
+    vs recomputing it, and the consistency check after each step.
+    """
+    import report_aggregates
+
+    n = args.projects
+    seed_final_tables(n)
+    print(f"{n:,} projects")
+    print(f"  {'step':<34} {'ms':>9}")
+
+    def timed(label, run):
+        db = app.SessionLocal()
+        try:
+            started = time.perf_counter()
+            result = run(db)
+            db.commit()
+            print(f"  {label:<34} {(time.perf_counter() - started) * 1000:>9.1f}")
+            return result
+        finally:
+            db.close()
+
+    def verify(label):
+        result = timed(f"consistency check ({label})", lambda db: report_aggregates.check(db, app.REPORT_TABLES))
+        if not result["consistent"]:
+            raise SystemExit(f"report aggregates out of date after {label}: {result}")
+
+    verify("seeded")
+    for changes in args.changes:
+        changed_uploads(n, changes, seed=changes)
+        timed(f"consolidate {changes:,} changed projects", lambda db: app.consolidate_all(db))
+        verify(f"{changes:,} changes")
+    timed("full rebuild", lambda db: report_aggregates.rebuild(db, app.REPORT_TABLES))
+
+    reports = {}
+    for engine in ("aggregate", "python", "sql"):
+        reports[engine] = timed(f"{engine} report", lambda db: app.REPORT_BUILDERS[engine](db, None))
+    if reports["aggregate"] != reports["python"] or repr(reports["aggregate"]) != repr(reports["sql"]):
+        raise SystemExit("aggregate report differs from the recomputed report")
+
+
+def legacy_ingest(db, upload_type, records, build_rows, model, columns):
+    """Upload without deduplication: a new upload and every row, as before content hashes."""
+    upload = app.create_upload(db, upload_type, "legacy.xlsx", commit=False)
+    return upload, app.bulk_insert(db, model.__table__, build_rows(records, upload), columns)
+
+
+def final_rows(db):
+    """Final CRM and ERP tables as sorted tuples (timestamps left out)."""
+    return [
+        db.execute(select(*[model.__table__.c[c] for c in columns]).order_by(model.__table__.c[columns[0]])).all()
+        for model, columns in ((app.CRMProjectFinal, app.CRM_FINAL_COLUMNS), (app.ERPSalesFinal, app.ERP_FINAL_COLUMNS))
+    ]
+
+
+def bench_dedup(args):
+    """
+    A monthly upload, its identical re-upload and a near-duplicate (args.changed
+    of the rows changed) for CRM and ERP, stored in full as before and with
+    content hashes; raw rows stored, time per step and incremental consolidation
+    after each. The final tables must come out the same both ways.
+    """
+    n = args.rows
+    rnd = random.Random(0)
+    picked = rnd.sample(range(n), int(n * args.changed))
+    sequences = {}
+    for kind in ("crm", "erp"):
+        generate = INGEST_TARGETS[kind][0]
+        monthly, changed = list(generate(n)), list(generate(n, seed=1))
+        near = list(monthly)
+        for i in picked:
+            near[i] = changed[i]
+        sequences[kind] = (("first upload", monthly), ("identical re-upload", monthly), ("near-duplicate", near))
+
+    print(f"{n:,} rows per upload, {len(picked):,} changed in the near-duplicate")
+    print(f"  {'mode':<7} {'kind':<4} {'step':<20} {'upload ms':>10} {'stored':>9} {'raw rows':>9} {'consolidate ms':>15}")
+    results = {}
+    for mode in ("legacy", "hashed"):
+        reset_tables(
+            app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.CRMProjectFinal, app.ERPSalesFinal,
+            app.ReportProjectAggregate, app.MonthlyUpload, app.ConsolidationWatermark,
+        )
+        for step in range(3):
+            for kind in ("crm", "erp"):
+                _, build_rows, model, columns, upload_type = INGEST_TARGETS[kind]
+                label, records = sequences[kind][step]
+                db = app.SessionLocal()
+                try:
+                    started = time.perf_counter()
+                    if mode == "legacy":
+                        _, stored = legacy_ingest(db, upload_type, records, build_rows, model, columns)
+                    else:
+                        stored = app.ingest_records(db, upload_type, label, records, build_rows, model, columns).stored
+                    db.commit()
+                    upload_ms = (time.perf_counter() - started) * 1000
+                    started = time.perf_counter()
+                    consolidate(db, full_rebuild=False)
+                    consolidate_ms = (time.perf_counter() - started) * 1000
+                    raw_rows = db.execute(select(func.count()).select_from(model.__table__)).scalar()
+                finally:
+                    db.close()
+                print(f"  {mode:<7} {kind:<4} {label:<20} {upload_ms:>10.1f} {stored:>9,} {raw_rows:>9,} {consolidate_ms:>15.1f}")
+        db = app.SessionLocal()
+        try:
+            results[mode] = final_rows(db)
+        finally:
+            db.close()
+    if results["legacy"] != results["hashed"]:
+        raise SystemExit("final tables differ between full and deduplicated uploads")
+
+
+def seed_monthly_uploads(n, months, changed, seed=0):
+    """
+    `months` monthly CRM and ERP uploads of the same n keys, one per month up
+    to the current one, each with a `changed` fraction of the rows changed,
+    consolidated as they arrive.
+    """
+    import retention
+
+    reset_tables(
+        app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.CRMProjectFinal, app.ERPSalesFinal,
+        app.ReportProjectAggregate, app.MonthlyUpload, app.ConsolidationWatermark, app.RawTablePartition,
+    )
+    rnd = random.Random(seed)
+    current = {kind: list(INGEST_TARGETS[kind][0](n, seed)) for kind in ("crm", "erp")}
+    this_month = retention.month_start(datetime.date.today())
+    db = app.SessionLocal()
+    try:
+        for ago in range(months - 1, -1, -1):
+            timestamp = datetime.datetime.combine(retention.months_before(this_month, ago), datetime.time(9))
+            for kind, records in current.items():
+                generate, build_rows, model, columns, upload_type = INGEST_TARGETS[kind]
+                replacements = list(generate(n, seed + months - ago))
+                for i in rnd.sample(range(n), int(n * changed)):
+                    records[i] = replacements[i]
+                upload = app.create_upload(db, upload_type, f"month-{ago}.xlsx", commit=False)
+                upload.upload_timestamp = timestamp
+                # As the compaction job would have ahead of that month's uploads
+                retention.ensure_partitions(
+                    db, app.RawTablePartition.__table__, model.__table__, [retention.month_start(timestamp)]
+                )
+                app.bulk_insert(db, model.__table__, build_rows(records, upload), columns)
+            db.commit()
+            app.consolidate_all(db)
+            db.commit()
+    finally:
+        db.close()
+
+
+def bench_compact(args):
+    """
+    Raw table size and the raw-table reads (rebuilding the final tables, the
+    newest-row lookups of deduplication) before and after compacting a year of
+    monthly uploads; the final tables must not change.
+    """
+    n = args.rows
+    seed_monthly_uploads(n, args.months, args.changed)
+    archive_dir = os.path.join(_tmpdir, "raw_archive")
+    tables = (app.CRMProjectRaw.__table__, app.ERPSalesRaw.__table__)
+    print(f"{args.months} monthly uploads x {n:,} rows, {args.changed:.0%} changed per month, "
+          f"keeping {args.retention_months} months")
+    print(f"  {'state':<9} {'raw rows':>10} {'full rebuild ms':>16} {'newest-row lookup ms':>21}")
+
+    def measure(label):
+        db = app.SessionLocal()
+        try:
+            raw_rows = sum(db.execute(select(func.count()).select_from(table)).scalar() for table in tables)
+            # The final tables from the raw history; the aggregates do not read the raw tables
+            started = time.perf_counter()
+            app.consolidate_upload_type(
+                db, "CRM", app.CRMProjectRaw, app.CRMProjectFinal, "project_id", app.CRM_FINAL_COLUMNS, True
+            )
+            app.consolidate_upload_type(
+                db, "ERP_Sales", app.ERPSalesRaw, app.ERPSalesFinal, "job_no", app.ERP_FINAL_COLUMNS, True
+            )
+            db.commit()
+            rebuild_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            deduplicator = dedup.RowDeduplicator(db, app.ERPSalesRaw.__table__, "job_no", app.ERP_RAW_COLUMNS)
+            deduplicator._load_latest(list(range(1, min(n, 1000) + 1)))
+            lookup_ms = (time.perf_counter() - started) * 1000
+            print(f"  {label:<9} {raw_rows:>10,} {rebuild_ms:>16.1f} {lookup_ms:>21.1f}")
+            return final_rows(db)
+        finally:
+            db.close()
+
+    before = measure("before")
+    db = app.SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = app.compact_raw_tables(db, args.retention_months, archive_dir)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+    archived = sum(table["archived_rows"] for table in result["tables"].values())
+    archive_bytes = sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(archive_dir) for name in names
+    )
+    print(f"  compaction: {archived:,} rows archived in {elapsed:.2f} s, {archive_bytes / 2**20:.1f} MiB of archives, "
+          f"months dropped: {sum(len(table['dropped_months']) for table in result['tables'].values())}")
+    if measure("after") != before:
+        raise SystemExit("final tables differ after compaction")
+
+
+def bench_pages(args):
+    """
+    Raw rows of one large upload read a page at a time: OFFSET pages vs
+    keyset pages at increasing depth, the whole upload in one response, a
+    walk through every API page (which must return every row once, in
+    order) and a revalidation with If-None-Match.
+    """
+    import pagination
+    from fastapi.testclient import TestClient
+
+    n, page = args.rows, args.page_size
+    reset_tables(app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.MonthlyUpload, app.RawTablePartition)
+    generate, build_rows, model, columns, upload_type = INGEST_TARGETS["crm"]
+    table = model.__table__
+    db = app.SessionLocal()
+    try:
+        # Another upload's rows around it, so the page queries select one upload out of several
+        for seed in (1, 0, 2):
+            upload = app.create_upload(db, upload_type, f"pages-{seed}.xlsx")
+            app.bulk_insert(db, table, build_rows(generate(n, seed), upload), columns)
+            if seed == 0:
+                upload_id = upload.upload_id
+        db.commit()
+        db.connection().exec_driver_sql("ANALYZE")
+        db.commit()
+        ids = db.execute(select(table.c.id).where(table.c.upload_id == upload_id).order_by(table.c.id)).scalars().all()
+        fields = dict(table.columns.items())
+        names = list(fields)
+
+        def best_ms(run, repeat=5):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+            return min(timings) * 1000
+
+        print(f"{n:,} rows in upload {upload_id} (of {3 * n:,} raw rows), {page} rows per page")
+        print(f"  {'depth':>9} {'offset ms':>10} {'keyset ms':>10}")
+        for depth in sorted({0, n // 10, n // 2, n - page}):
+            # The same rows as dicts, so the two differ only in the query
+            offset_query = (
+                select(*[fields[name].label(name) for name in names])
+                .where(table.c.upload_id == upload_id).order_by(table.c.id).offset(depth).limit(page)
+            )
+
+            def offset_page():
+                return [dict(row) for row in db.execute(offset_query).mappings()]
+
+            after = ids[depth - 1] if depth else None
+            keyset_rows, _ = pagination.keyset_page(db, fields, "id", names, (table.c.upload_id == upload_id,), after, page)
+            if offset_page() != keyset_rows:
+                raise SystemExit(f"keyset page at depth {depth} differs from the OFFSET page")
+            offset_ms = best_ms(offset_page)
+            keyset_ms = best_ms(lambda: pagination.keyset_page(
+                db, fields, "id", names, (table.c.upload_id == upload_id,), after, page
+            ))
+            print(f"  {depth:>9,} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+
+        # What an unpaginated endpoint would do per request
+        started = time.perf_counter()
+        rows, _ = pagination.keyset_page(db, fields, "id", names, (table.c.upload_id == upload_id,), None, n)
+        body = pagination.json_body(rows)
+        print(f"  whole upload, one response: {(time.perf_counter() - started) * 1000:.0f} ms, "
+              f"{len(body) / 2**20:.1f} MiB")
+    finally:
+        db.close()
+
+    client = TestClient(app.app)
+    url = f"/api/uploads/crm/{upload_id}/rows"
+
+    seen, pages, size = [], 0, 0
+    next_url = f"{url}?limit={page}&fields=project_id,project_name"
+    started = time.perf_counter()
+    while next_url:
+        response = client.get(next_url)
+        response.raise_for_status()
+        seen.extend(row["id"] for row in response.json())
+        pages += 1
+        size = max(size, len(response.content))
+        link = response.headers.get("link")
+        next_url = link[1:link.index(">")] if link else None
+    elapsed = time.perf_counter() - started
+    print(f"  every page, 3 fields: {pages:,} pages in {elapsed * 1000:.0f} ms "
+          f"({elapsed / pages * 1000:.2f} ms per page, at most {size / 1024:.1f} KiB)")
+    if seen != ids:
+        raise SystemExit("the pages do not return every row of the upload once, in order")
+
+    started = time.perf_counter()
+    first = client.get(url, params={"limit": page})
+    page_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    revalidated = client.get(url, params={"limit": page}, headers={"If-None-Match": first.headers["etag"]})
+    elapsed = time.perf_counter() - started
+    print(f"  revalidation: {revalidated.status_code} in {elapsed * 1000:.2f} ms, "
+          f"{len(revalidated.content)} bytes (page: {page_elapsed * 1000:.2f} ms, {len(first.content) / 1024:.1f} KiB)")
+    if revalidated.status_code != 304 or revalidated.content:
+        raise SystemExit("an unchanged page was not answered with an empty 304")
+
+
+# ERP jobs per CRM project in the pipeline payloads; the others are CRM-only projects
+PIPELINE_ERP_SHARE = 0.8
+
+
+def pipeline_records(n, seed=0):
+    """
+    Records of a CRM, ERP and DataCode upload with the column names the
+    frontend sends: n CRM projects, ERP jobs with the number and name of 80%
+    of them (so they take the project's rank) and a DataCode row per project.
+    """
+    erp = erp_export_records(int(n * PIPELINE_ERP_SHARE), seed)
+    for i, record in enumerate(erp):
+        record.update({"Client Code": f"C{i % 500:04d}", "Client name": f"Company {i % 500}", "Project name": f"Project {i}"})
+    return {
+        "crm": [record.model_dump(by_alias=True) for record in synthetic_crm_records(n, seed)],
+        "erp": erp,
+        "datacode": [record.model_dump(by_alias=True) for record in synthetic_datacode_records(n, seed)],
+    }
+
+
+def pipeline_payloads(n, seed=0):
+    """pipeline_records as the JSON bodies of their upload requests."""
+    return {
+        kind: json.dumps({"file_name": f"pipeline-{kind}.xlsx", "month": "April", "records": records}).encode()
+        for kind, records in pipeline_records(n, seed).items()
+    }
+
+
+def reset_peak_rss():
+    """Restart the kernel's peak RSS of this process (Linux); elsewhere the peak stays the process's."""
+    with contextlib.suppress(OSError):
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+
+
+def peak_rss_mib():
+    with contextlib.suppress(OSError):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+# Every table the pipeline writes, children first
+PIPELINE_MODELS = (
+    app.ReportSnapshotChunk, app.PerformanceReportGenerationHistory, app.ReportProjectAggregate,
+    app.CRMProjectRaw, app.ERPSalesRaw, app.DataCodeRaw, app.CRMProjectFinal, app.ERPSalesFinal,
+    app.MonthlyUpload, app.ConsolidationWatermark, app.RawTablePartition,
+)
+
+
+def reset_pipeline():
+    reset_tables(*PIPELINE_MODELS)
+    app.report_cache.invalidate()
+
+
+def run_pipeline(client, payloads, engine=None):
+    """
+    Upload, consolidate, generate and read back a report through the API on
+    empty tables. Returns per stage: wall seconds, statements, database ms
+    and peak RSS (MiB).
+    """
+    reset_pipeline()
+    report_params = {"refresh": "true", **({"engine": engine} if engine else {})}
+    stages = [
+        ("upload_crm", "POST", "/api/upload/crm", None, payloads["crm"]),
+        ("upload_erp", "POST", "/api/upload/erp/sales", None, payloads["erp"]),
+        ("upload_datacode", "POST", "/api/upload/datacode", None, payloads["datacode"]),
+        ("consolidate", "POST", "/api/consolidate", None, None),
+        ("generate_report", "POST", "/api/generate_report", report_params, None),
+        ("read_report", "GET", "/api/latest_report", None, None),
+    ]
+    results = {}
+    for stage, method, url, params, body in stages:
+        headers = {"Content-Type": "application/json"} if body is not None else None
+        dbmetrics.endpoint_stats.reset()
+        reset_peak_rss()
+        started = time.perf_counter()
+        response = client.request(method, url, params=params, content=body, headers=headers)
+        elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        if stage == "read_report" and not response.json()["row_count"]:
+            raise SystemExit("the pipeline generated an empty report")
+        endpoints = dbmetrics.endpoint_stats.to_dict().values()
+        results[stage] = {
+            "seconds": round(elapsed, 4),
+            "queries": sum(entry["queries"] for entry in endpoints),
+            "query_ms": round(sum(entry["query_ms_total"] for entry in endpoints), 1),
+            "peak_rss_mib": round(peak_rss_mib(), 1),
+        }
+    return results
+
+
+def pipeline_regressions(results, baseline, time_tolerance, rss_tolerance, min_seconds):
+    """
+    Stage metrics worse than the baseline's: wall time beyond time_tolerance
+    (and min_seconds), more statements, peak RSS beyond rss_tolerance.
+    Scales and stages missing from the baseline are not compared.
+    """
+    regressions = []
+    for scale, stages in results["scales"].items():
+        for stage, measured in stages.items():
+            expected = baseline["scales"].get(scale, {}).get(stage)
+            if expected is None:
+                continue
+            label = f"{int(scale):,} projects, {stage}"
+            if (measured["seconds"] > expected["seconds"] * (1 + time_tolerance)
+                    and measured["seconds"] - expected["seconds"] > min_seconds):
+                regressions.append(f"{label}: {expected['seconds']:.3f} s -> {measured['seconds']:.3f} s")
+            if measured["queries"] > expected["queries"]:
+                regressions.append(f"{label}: {expected['queries']} -> {measured['queries']} statements")
+            if measured["peak_rss_mib"] > expected["peak_rss_mib"] * (1 + rss_tolerance):
+                regressions.append(
+                    f"{label}: peak RSS {expected['peak_rss_mib']:.1f} -> {measured['peak_rss_mib']:.1f} MiB"
+                )
+    return regressions
+
+
+def bench_pipeline(args):
+    """
+    The whole pipeline through the API at each scale (best of args.repeat
+    runs per stage), saved as a JSON baseline with --save and checked against
+    one with --baseline: any regressed stage metric fails the run.
+    """
+    from fastapi.testclient import TestClient
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    client = TestClient(app.app)
+    results = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "database": app.engine.dialect.name,
+        "python": platform.python_version(),
+        "engine": args.engine,
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    # First requests pay for imports, adapters and prepared caches
+    run_pipeline(client, pipeline_payloads(100), args.engine)
+    print(f"  {'projects':>9} {'stage':<16} {'seconds':>9} {'baseline':>9} {'statements':>11} {'db ms':>9} {'peak RSS MiB':>13}")
+    for n in args.projects:
+        payloads = pipeline_payloads(n)
+        runs = [run_pipeline(client, payloads, args.engine) for _ in range(args.repeat)]
+        # Best time and memory of the runs; the statement count should not vary
+        stages = {
+            stage: {
+                "seconds": min(run[stage]["seconds"] for run in runs),
+                "queries": max(run[stage]["queries"] for run in runs),
+                "query_ms": min(run[stage]["query_ms"] for run in runs),
+                "peak_rss_mib": min(run[stage]["peak_rss_mib"] for run in runs),
+            }
+            for stage in runs[0]
+        }
+        results["scales"][str(n)] = stages
+        for stage, measured in stages.items():
+            expected = (baseline or {}).get("scales", {}).get(str(n), {}).get(stage)
+            reference = f"{expected['seconds']:>9.3f}" if expected else f"{'-':>9}"
+            print(f"  {n:>9,} {stage:<16} {measured['seconds']:>9.3f} {reference} {measured['queries']:>11,} "
+                  f"{measured['query_ms']:>9.1f} {measured['peak_rss_mib']:>13.1f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"saved {args.save}")
+    if baseline is not None:
+        regressions = pipeline_regressions(
+            results, baseline, args.time_tolerance, args.rss_tolerance, args.min_seconds
+        )
+        for regression in regressions:
+            print(f"REGRESSION  {regression}")
+        if regressions:
+            raise SystemExit(f"{len(regressions)} stage metrics regressed against {args.baseline}")
+        print(f"no regressions against {args.baseline}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="bulk ingestion rows/sec and peak memory")
+    ingest.add_argument("--kind", choices=sorted(INGEST_TARGETS), default="erp")
+    ingest.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    ingest.add_argument("--batch-size", type=int, default=app.INGEST_BATCH_SIZE)
+    ingest.set_defaults(func=bench_ingest)
+
+    upload = sub.add_parser("upload", help="JSON vs streamed multipart CSV upload through the API")
+    upload.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    upload.set_defaults(func=bench_upload)
+
+    load = sub.add_parser("load", help="concurrent request throughput, sync vs async endpoints")
+    load.add_argument("--projects", type=int, default=5_000)
+    load.add_argument("--requests", type=int, default=40)
+    load.add_argument("--upload-rows", type=int, default=5_000)
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    load.set_defaults(func=bench_load)
+
+    consolidate = sub.add_parser("consolidate", help="legacy per-row vs set-based consolidation")
+    consolidate.add_argument("--rows", type=int, default=10_000, help="rows per upload")
+    consolidate.add_argument("--uploads", type=int, default=3)
+    consolidate.set_defaults(func=bench_consolidate)
+
+    report = sub.add_parser("report", help="report builder scaling with input size")
+    report.add_argument("--projects", type=int, nargs="+", default=[1_000, 2_000, 4_000, 8_000, 16_000])
+    report.add_argument("--engines", nargs="+", choices=app.REPORT_ENGINES)
+    report.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="skip the golden-output equivalence check")
+    report.set_defaults(func=bench_report)
+
+    report_db = sub.add_parser("report-db", help="report engines end to end against a seeded database")
+    report_db.add_argument("--projects", type=int, nargs="+", default=[10_000, 50_000])
+    report_db.add_argument("--engines", nargs="+", choices=app.REPORT_ENGINES)
+    report_db.add_argument("--fiscal-year", type=int, help="report a single fiscal year (April-March)")
+    report_db.set_defaults(func=bench_report_db)
+
+    report_memory = sub.add_parser("report-memory", help="report accumulator memory per project")
+    report_memory.add_argument("--projects", type=int, default=100_000)
+    report_memory.set_defaults(func=bench_report_memory)
+
+    dates_cmd = sub.add_parser("dates", help="strptime vs cached date parsing, with a strptime equivalence check")
+    dates_cmd.add_argument("--rows", type=int, default=500_000)
+    dates_cmd.add_argument("--distinct", type=int, default=300, help="distinct dates in the export")
+    dates_cmd.set_defaults(func=bench_dates)
+
+    snapshots_cmd = sub.add_parser("snapshots", help="compressed report snapshot size and paged read cost")
+    snapshots_cmd.add_argument("--projects", type=int, default=50_000)
+    snapshots_cmd.add_argument("--page-size", type=int, default=100)
+    snapshots_cmd.set_defaults(func=bench_snapshots)
+
+    compare = sub.add_parser("compare", help="server-side report comparison, streamed vs full load")
+    compare.add_argument("--projects", type=int, default=50_000)
+    compare.set_defaults(func=bench_compare)
+
+    validation = sub.add_parser("validation", help="ERP upload validation rows/sec, legacy vs lean schema")
+    validation.add_argument("--rows", type=int, nargs="+", default=[100_000])
+    validation.set_defaults(func=bench_validation)
+
+    aggregates = sub.add_parser("aggregates", help="incremental report aggregates vs full rebuild and recompute")
+    aggregates.add_argument("--projects", type=int, default=50_000)
+    aggregates.add_argument("--changes", type=int, nargs="+", default=[50, 500, 5_000])
+    aggregates.set_defaults(func=bench_aggregates)
+
+    dedup_cmd = sub.add_parser("dedup", help="repeated and near-duplicate uploads, stored in full vs deduplicated")
+    dedup_cmd.add_argument("--rows", type=int, default=50_000)
+    dedup_cmd.add_argument("--changed", type=float, default=0.01, help="fraction of rows changed in the near-duplicate")
+    dedup_cmd.set_defaults(func=bench_dedup)
+
+    compact = sub.add_parser("compact", help="raw table compaction: size and raw reads before and after")
+    compact.add_argument("--rows", type=int, default=20_000)
+    compact.add_argument("--months", type=int, default=12)
+    compact.add_argument("--changed", type=float, default=0.05, help="fraction of rows changed per month")
+    compact.add_argument("--retention-months", type=int, default=3)
+    compact.set_defaults(func=bench_compact)
+
+    pages = sub.add_parser("pages", help="raw row pages through the API: OFFSET vs keyset, projection, 304s")
+    pages.add_argument("--rows", type=int, default=100_000, help="rows of the paged upload")
+    pages.add_argument("--page-size", type=int, default=100)
+    pages.set_defaults(func=bench_pages)
+
+    pipeline = sub.add_parser("pipeline", help="upload, consolidate and report through the API, with a JSON baseline")
+    pipeline.add_argument("--projects", type=int, nargs="+", default=[1_000, 10_000])
+    pipeline.add_argument("--engine", choices=app.REPORT_ENGINES, help="report engine (the endpoint's default)")
+    pipeline.add_argument("--repeat", type=int, default=3, help="runs per scale; the best of each stage counts")
+    pipeline.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    pipeline.add_argument("--baseline", metavar="PATH", help="fail on regressions against this baseline")
+    pipeline.add_argument("--time-tolerance", type=float, default=0.5, help="allowed wall time increase (fraction)")
+    pipeline.add_argument("--rss-tolerance", type=float, default=0.25, help="allowed peak RSS increase (fraction)")
+    pipeline.add_argument("--min-seconds", type=float, default=0.05,
+                          help="wall time increases below this are noise, whatever the fraction")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import zlib
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Dialects whose INSERT supports ON CONFLICT ... DO UPDATE
+_UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+# With the final table's name, serializes consolidation runs into one final table (PostgreSQL)
+CONSOLIDATION_LOCK_KEY = 0x646F6C65
+
+
+def lock_final_table(db, final_table):
+    """
+    Hold the final table's consolidation lock until the transaction ends, so
+    that concurrent runs (incremental and full rebuild jobs, /api/consolidate)
+    take turns instead of racing on the final table and the uploads' state.
+    Take it before reading that state: each run then sees the one before it
+    committed. SQLite serializes writers already.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:key, :table_key)"),
+            {"key": CONSOLIDATION_LOCK_KEY, "table_key": zlib.crc32(final_table.name.encode()) & 0x7FFFFFFF},
+        )
+
+
+def latest_rows(raw_table, key, columns, upload_ids=None):
+    """
+    SELECT the newest raw row (highest id) for every non-null key.
+    Raw rows are append-only, so the highest id is the most recent upload.
+
+    `upload_ids` optionally restricts the selection to the keys that occur in
+    those uploads; their newest row may still come from any upload.
+    """
+    latest_ids = select(func.max(raw_table.c.id)).where(raw_table.c[key].isnot(None))
+    if upload_ids is not None:
+        keys = select(raw_table.c[key]).where(raw_table.c.upload_id.in_(upload_ids))
+        latest_ids = latest_ids.where(raw_table.c[key].in_(keys))
+    latest_ids = latest_ids.group_by(raw_table.c[key])
+    return select(*[raw_table.c[c] for c in columns]).where(raw_table.c.id.in_(latest_ids))
+
+
+def upsert_latest(db, raw_table, final_table, key, columns, upload_ids=None):
+    """
+    Fold the latest raw row per key into the final table with a single
+    INSERT ... SELECT ... ON CONFLICT (key) DO UPDATE statement.
+
+    `columns` are the column names shared by both tables (including `key`).
+    `upload_ids` limits the fold to the keys of those uploads (see latest_rows).
+    Returns the number of rows inserted or updated.
+    """
+    dialect = db.get_bind().dialect.name
+    make_insert = _UPSERT_INSERTS.get(dialect)
+    if make_insert is None:
+        raise RuntimeError(
+            f"Consolidation needs INSERT ... ON CONFLICT, which the '{dialect}' database does not support. "
+            f"Supported databases: {', '.join(sorted(_UPSERT_INSERTS))}."
+        )
+
+    stmt = make_insert(final_table).from_select(
+        columns, latest_rows(raw_table, key, columns, upload_ids)
+    )
+    updates = {c: stmt.excluded[c] for c in columns if c != key}
+    if "last_updated" in final_table.c:
+        updates["last_updated"] = func.now()
+    stmt = stmt.on_conflict_do_update(index_elements=[key], set_=updates)
+    # SQLAlchemy only keeps the rowcount of UPDATE and DELETE by default (-1 for this INSERT on psycopg)
+    return db.execute(stmt, execution_options={"preserve_rowcount": True}).rowcount
+
@@ -0,0 +1,95 @@
+"""
+Engine construction from configuration.
+
+Environment:
+    DATABASE_URL            full SQLAlchemy URL; when unset it is assembled from
+                            DB_USER, DB_PASSWORD, DB_HOST, DB_PORT and DB_NAME
+    DB_POOL_SIZE            connections kept open per engine (default 5)
+    DB_MAX_OVERFLOW         extra connections allowed under bursts (default 10)
+    DB_POOL_TIMEOUT         seconds to wait for a free connection (default 30)
+    DB_POOL_RECYCLE         seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING        test connections on checkout (default true)
+    DB_STATEMENT_TIMEOUT_MS server-side statement timeout, PostgreSQL only (default 0: off)
+"""
+import logging
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.pool import QueuePool
+
+from dbmetrics import TimedQueuePool, instrument_engine
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+def database_url() -> str:
+    """DATABASE_URL, or a PostgreSQL URL assembled from the DB_* variables."""
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    return URL.create(
+        "postgresql",
+        username=os.getenv("DB_USER", "myuser"),
+        password=os.getenv("DB_PASSWORD", "mypassword"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        database=os.getenv("DB_NAME", "mydb"),
+    ).render_as_string(hide_password=False)
+
+
+def _statement_timeout_args(url, timeout_ms):
+    if not timeout_ms:
+        return {}
+    if url.get_backend_name() != "postgresql":
+        logger.debug("Statement timeout is only applied on PostgreSQL, not %s", url.get_backend_name())
+        return {}
+    return {"options": f"-c statement_timeout={timeout_ms}"}
+
+
+def engine_options(
+    url,
+    pool_size=None,
+    max_overflow=None,
+    pool_timeout=None,
+    pool_recycle=None,
+    pool_pre_ping=None,
+    statement_timeout_ms=None,
+):
+    """
+    Keyword arguments for create_engine. Pool sizing only applies when the
+    dialect pools through a QueuePool (not for in-memory SQLite); arguments
+    left as None fall back to the DB_* settings.
+    """
+    url = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING if pool_pre_ping is None else pool_pre_ping}
+
+    default_pool = url.get_dialect().get_pool_class(url)
+    if issubclass(default_pool, QueuePool):
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE if pool_size is None else pool_size,
+            max_overflow=DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+            pool_timeout=DB_POOL_TIMEOUT if pool_timeout is None else pool_timeout,
+            pool_recycle=DB_POOL_RECYCLE if pool_recycle is None else pool_recycle,
+        )
+
+    connect_args = _statement_timeout_args(
+        url, DB_STATEMENT_TIMEOUT_MS if statement_timeout_ms is None else statement_timeout_ms
+    )
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def make_engine(url, **overrides):
+    engine = create_engine(url, **engine_options(url, **overrides))
+    instrument_engine(engine)
+    return engine
@@ -0,0 +1,85 @@
+"""
+Date parsing shared by the upload row builders and the report engines.
+
+Monthly exports repeat the same few hundred dates across thousands of rows,
+so parsed strings are memoized in a bounded LRU cache. The fixed-width forms
+of the formats used here ("04/30/24", "24/04/30", "2024-04-30 00:00:00") are
+sliced directly; anything else goes through strptime, which also produces the
+error messages for invalid input.
+
+Environment:
+    DATE_CACHE_SIZE     distinct (text, format) pairs kept (default 4096)
+"""
+import datetime
+import functools
+import os
+
+DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", "4096"))
+
+CRM_DATE_FORMAT = "%m/%d/%y"
+ERP_DATE_FORMAT = "%y/%m/%d"
+REPORT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def _two_digit_year(value):
+    # Same pivot as strptime's %y: 69-99 -> 1969-1999, 00-68 -> 2000-2068
+    return value + (1900 if value >= 69 else 2000)
+
+
+def _fixed_width(text, fmt):
+    """date for the fixed-width form of a known format, None to fall back to strptime."""
+    if not text.isascii():
+        return None
+    if fmt == CRM_DATE_FORMAT:
+        if len(text) == 8 and text[2] == "/" and text[5] == "/":
+            digits = text[0:2] + text[3:5] + text[6:8]
+            if digits.isdigit():
+                return datetime.date(_two_digit_year(int(text[6:8])), int(text[0:2]), int(text[3:5]))
+    elif fmt == ERP_DATE_FORMAT:
+        if len(text) == 8 and text[2] == "/" and text[5] == "/":
+            digits = text[0:2] + text[3:5] + text[6:8]
+            if digits.isdigit():
+                return datetime.date(_two_digit_year(int(text[0:2])), int(text[3:5]), int(text[6:8]))
+    elif fmt == REPORT_DATETIME_FORMAT:
+        # Only midnight is sliced; other times are validated by strptime
+        if len(text) == 19 and text[4] == "-" and text[7] == "-" and text[10:] == " 00:00:00":
+            digits = text[0:4] + text[5:7] + text[8:10]
+            if digits.isdigit():
+                return datetime.date(int(text[0:4]), int(text[5:7]), int(text[8:10]))
+    return None
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse(text, fmt):
+    try:
+        parsed = _fixed_width(text, fmt)
+    except ValueError:
+        # Well-formed but not a real date (e.g. 02/30/24); strptime raises the usual error
+        parsed = None
+    if parsed is not None:
+        return parsed
+    return datetime.datetime.strptime(text, fmt).date()
+
+
+def parse_date(text, fmt):
+    """Parse `text` with a strptime format into a date; raises ValueError when it does not match."""
+    return _parse(text, fmt)
+
+
+def to_date(value, fmt=REPORT_DATETIME_FORMAT):
+    """date from a date, datetime or string in `fmt`; raises ValueError / TypeError otherwise."""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        return _parse(value, fmt)
+    raise TypeError(f"Expected a date or a string, got {type(value).__name__}")
+
+
+def fiscal_year_range(fiscal_year):
+    """[start, end) dates of a fiscal year, which runs April to March and is named by its start year."""
+    return datetime.date(fiscal_year, 4, 1), datetime.date(fiscal_year + 1, 4, 1)
+
+
+def cache_info():
+    return _parse.cache_info()
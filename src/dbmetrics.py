@@ -0,0 +1,182 @@
+"""
+Connection pool and query instrumentation.
+
+- TimedQueuePool times every connection checkout
+  (including waiting for a free connection) into `pool.wait_stats`.
+- instrument_engine() hooks cursor execution, and every statement is
+  attributed to the unit of work currently being tracked: an HTTP endpoint
+  (QueryMetricsMiddleware) or a background job (track()).
+- pool_status() and `endpoint_stats` feed the /api/metrics/db endpoint.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+_current = contextvars.ContextVar("dbmetrics_counter", default=None)
+
+
+class WaitStats:
+    """Time spent obtaining a connection from the pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_dict(self):
+        return {
+            "checkouts": self.checkouts,
+            "wait_ms_total": round(self.total_seconds * 1000, 3),
+            "wait_ms_avg": round(self.total_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            "wait_ms_max": round(self.max_seconds * 1000, 3),
+        }
+
+
+class _TimedGet:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+
+class TimedQueuePool(_TimedGet, QueuePool):
+    pass
+
+
+def pool_status(engine):
+    """Checked-out / idle / overflow connections of an engine's pool."""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            # QueuePool reports a negative overflow until pool_size connections are open
+            overflow=max(0, pool.overflow()),
+        )
+    wait_stats = getattr(pool, "wait_stats", None)
+    if wait_stats is not None:
+        status.update(wait_stats.to_dict())
+    return status
+
+
+class QueryCounter:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+class EndpointStats:
+    """Per-label totals: calls, statements and time spent in the database."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, label, counter):
+        with self._lock:
+            entry = self._stats.setdefault(
+                label, {"calls": 0, "queries": 0, "query_seconds": 0.0, "max_queries": 0}
+            )
+            entry["calls"] += 1
+            entry["queries"] += counter.queries
+            entry["query_seconds"] += counter.seconds
+            entry["max_queries"] = max(entry["max_queries"], counter.queries)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                label: {
+                    "calls": entry["calls"],
+                    "queries": entry["queries"],
+                    "queries_per_call": round(entry["queries"] / entry["calls"], 2),
+                    "max_queries": entry["max_queries"],
+                    "query_ms_total": round(entry["query_seconds"] * 1000, 3),
+                    "query_ms_per_call": round(entry["query_seconds"] * 1000 / entry["calls"], 3),
+                }
+                for label, entry in sorted(self._stats.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+@contextlib.contextmanager
+def track(label, stats=endpoint_stats):
+    """Attribute the statements executed inside the block to `label`."""
+    counter = QueryCounter()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
+        stats.record(label, counter)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, so a failed statement leaves nothing behind
+    if context is not None:
+        context._dbmetrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is None:
+        return
+    counter.queries += 1
+    started = getattr(context, "_dbmetrics_started", None)
+    if started is not None:
+        counter.seconds += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    """Count and time cursor executions on a sync Engine (use .sync_engine for async)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryMetricsMiddleware:
+    """ASGI middleware tracking each HTTP request under "METHOD /route/template"."""
+
+    def __init__(self, app, stats=endpoint_stats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        counter = QueryCounter()
+        token = _current.set(counter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so 404 scans do not grow the table
+            path = getattr(route, "path", None) or "<unmatched>"
+            self.stats.record(f"{scope['method']} {path}", counter)
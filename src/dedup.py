@@ -0,0 +1,112 @@
+"""
+Deduplication of repeated uploads.
+
+Every raw row gets a hash of its content (all columns but upload_id,
+record_timestamp and the hash itself), and every upload a hash of its rows'
+hashes in order. An upload with the same content hash as the newest upload of
+its type is a re-upload: its rows are dropped and the existing upload_id is
+returned (see app.ingest_records).
+
+Of any other upload only the changed rows are stored. Consolidation and the
+report read raw rows as the newest row per key (CRM project_id, ERP job_no),
+so a row identical to the newest stored row with its key changes nothing and
+is skipped. DataCode rows have no key and parent codes come from the first
+row per project name, so a DataCode row is skipped when an identical row is
+already stored. Rows stored before the hash columns existed have no hash and
+never match.
+"""
+import hashlib
+import zlib
+from operator import itemgetter
+
+from sqlalchemy import func, select, text
+
+from ingest import iter_batches
+
+# Columns left out of the row hash: they differ between uploads of the same row
+UNHASHED_COLUMNS = ("upload_id", "record_timestamp", "row_hash")
+# Rows whose stored hashes are looked up per statement
+LOOKUP_BATCH_ROWS = 1000
+# With the raw table's name, serializes uploads into one raw table (PostgreSQL)
+DEDUP_LOCK_KEY = 0x646F6C64
+
+
+def hashed_columns(columns):
+    return [c for c in columns if c not in UNHASHED_COLUMNS]
+
+
+def row_hash(values):
+    """
+    Hex digest of a row's values (a tuple, see hashed_columns). The built rows
+    hold None, bool, int, float, str and date values, whose repr is exact and
+    tells the types apart; it is about twice as fast as json.dumps here.
+    """
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+
+def _lock(db, table):
+    # Each upload then compares against the rows of the uploads committed before it
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:key, :table_key)"),
+            {"key": DEDUP_LOCK_KEY, "table_key": zlib.crc32(table.name.encode()) & 0x7FFFFFFF},
+        )
+
+
+class RowDeduplicator:
+    """
+    Hashes the built rows of one upload into raw_table and drops those that
+    would change nothing (see the module docstring). key is the raw table's
+    key column, or None to compare whole rows. After the rows are consumed,
+    content_hash, rows and stored describe the upload.
+    """
+
+    def __init__(self, db, raw_table, key, columns, batch_rows=LOOKUP_BATCH_ROWS):
+        self.db = db
+        self.table = raw_table
+        self.key = key
+        self._values = itemgetter(*hashed_columns(columns))
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.stored = 0
+        self._content = hashlib.sha256()
+        # key -> hash of its newest row, stored or from this upload (hash -> hash without a key)
+        self._latest = {}
+
+    @property
+    def content_hash(self):
+        return self._content.hexdigest()
+
+    def _load_latest(self, keys):
+        table = self.table
+        if self.key is None:
+            query = select(table.c.row_hash, table.c.row_hash).where(table.c.row_hash.in_(keys)).distinct()
+        else:
+            newest_ids = select(func.max(table.c.id)).where(table.c[self.key].in_(keys)).group_by(table.c[self.key])
+            query = select(table.c[self.key], table.c.row_hash).where(table.c.id.in_(newest_ids))
+        # Keys without stored rows are remembered too, so they are not looked up again
+        self._latest.update(dict.fromkeys(keys))
+        self._latest.update(self.db.execute(query).all())
+
+    def filter(self, rows):
+        """Yield the rows to store, with their row_hash set."""
+        _lock(self.db, self.table)
+        for batch in iter_batches(rows, self.batch_rows):
+            for row in batch:
+                row["row_hash"] = row_hash(self._values(row))
+            keys = {row["row_hash"] if self.key is None else row[self.key] for row in batch}
+            keys.discard(None)
+            keys.difference_update(self._latest)
+            if keys:
+                self._load_latest(sorted(keys))
+            for row in batch:
+                digest = row["row_hash"]
+                self._content.update(bytes.fromhex(digest))
+                self.rows += 1
+                key = digest if self.key is None else row[self.key]
+                if key is not None and self._latest.get(key) == digest:
+                    continue
+                if key is not None:
+                    self._latest[key] = digest
+                self.stored += 1
+                yield row
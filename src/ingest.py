@@ -0,0 +1,86 @@
+import csv
+import io
+import itertools
+
+# Default number of rows written per batch (overridable per call)
+DEFAULT_BATCH_SIZE = 5000
+
+# Marker written for NULL values in the COPY stream
+COPY_NULL = "\\N"
+
+
+def iter_batches(rows, batch_size):
+    """
+    Yield lists of at most batch_size rows from any iterable, so callers can
+    stream generators without materializing the whole upload.
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    return value
+
+
+def _copy_batch(cursor, table, columns, batch):
+    """
+    Write one batch through PostgreSQL COPY ... FROM STDIN (psycopg2 or psycopg 3).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in batch:
+        writer.writerow([_copy_value(row.get(c)) for c in columns])
+    buf.seek(0)
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    statement = f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL \'{COPY_NULL}\')'
+    if hasattr(cursor, "copy_expert"):
+        cursor.copy_expert(statement, buf)
+    else:
+        with cursor.copy(statement) as copy:
+            copy.write(buf.getvalue())
+
+
+def supports_copy(db):
+    """
+    COPY is only used on PostgreSQL through a driver exposing copy_expert
+    (psycopg2) or copy (psycopg 3, SQLAlchemy's default postgresql driver).
+    Every other backend (SQLite in tests) uses multi-row INSERTs.
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    cursor = db.connection().connection.cursor()
+    try:
+        return hasattr(cursor, "copy_expert") or hasattr(cursor, "copy")
+    finally:
+        cursor.close()
+
+
+def bulk_insert(db, table, rows, columns, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert an iterable of row dicts into `table` in batches, inside the
+    session's current transaction. Nothing is committed here.
+
+    Returns the number of rows written.
+    """
+    use_copy = supports_copy(db)
+    cursor = db.connection().connection.cursor() if use_copy else None
+    insert_stmt = table.insert()
+    total = 0
+    try:
+        for batch in iter_batches(rows, batch_size):
+            if use_copy:
+                _copy_batch(cursor, table, columns, batch)
+            else:
+                db.execute(insert_stmt, batch)
+            total += len(batch)
+    finally:
+        if cursor is not None:
+            cursor.close()
+    return total
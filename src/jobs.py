@@ -0,0 +1,174 @@
+"""
+Background jobs for long-running operations (consolidation, report generation).
+
+A JobQueue hands work to a JobBackend and keeps the status, progress and
+result of every job in memory so clients can poll for them. Submitting a job
+whose dedup key matches a queued or running job returns that job instead of
+starting a second one.
+
+Backends only need `submit(fn)` and `shutdown()`: ThreadPoolBackend runs jobs
+on an in-process worker pool, InlineBackend runs them in the caller's thread
+(scripts, benchmarks, debugging).
+"""
+import datetime
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class Job:
+    """State of one submitted job; `progress` is a fraction in [0, 1]."""
+
+    def __init__(self, job_id, kind, key=None):
+        self.id = job_id
+        self.kind = kind
+        self.key = key
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = None
+        self.result = None
+        self.error = None
+        self.submitted_at = _now()
+        self.started_at = None
+        self.finished_at = None
+
+    def report_progress(self, progress, message=None):
+        """Called by the job function while it runs."""
+        self.progress = max(0.0, min(1.0, float(progress)))
+        if message is not None:
+            self.message = message
+
+    @property
+    def done(self):
+        return self.status not in ACTIVE_STATES
+
+    def to_dict(self, include_result=True):
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        if include_result and self.status == SUCCEEDED:
+            data["result"] = self.result
+        return data
+
+
+class JobBackend:
+    """Executes zero-argument callables; subclasses decide where and when."""
+
+    def submit(self, fn):
+        raise NotImplementedError
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class ThreadPoolBackend(JobBackend):
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, fn):
+        self._executor.submit(fn)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class InlineBackend(JobBackend):
+    """Runs the job before submit() returns."""
+
+    def submit(self, fn):
+        fn()
+
+
+def make_backend(name, max_workers=2):
+    """Backend by name, as configured through JOB_BACKEND."""
+    if name == "thread":
+        return ThreadPoolBackend(max_workers=max_workers)
+    if name == "inline":
+        return InlineBackend()
+    raise ValueError(f"Unknown job backend '{name}'. Expected 'thread' or 'inline'.")
+
+
+class JobQueue:
+    """
+    In-memory job registry in front of a backend. Finished jobs are kept
+    (oldest dropped first) up to `max_finished` so their results can be polled.
+    """
+
+    def __init__(self, backend, max_finished=100):
+        self.backend = backend
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._active_by_key = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, key=None):
+        """
+        Queue fn(job) and return the Job. With a key, an identical queued or
+        running job is returned instead; the bool tells whether it is new.
+        """
+        with self._lock:
+            if key is not None:
+                existing = self._active_by_key.get(key)
+                if existing is not None:
+                    return existing, False
+            job = Job(str(next(self._ids)), kind, key)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._active_by_key[key] = job
+            self._prune()
+        self.backend.submit(lambda: self._run(job, fn))
+        return job, True
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job, fn):
+        job.status = RUNNING
+        job.started_at = _now()
+        try:
+            job.result = fn(job)
+            job.progress = 1.0
+            job.status = SUCCEEDED
+        except Exception as e:
+            job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            job.status = FAILED
+            logger.exception("Job %s (%s) failed", job.id, job.kind)
+        finally:
+            job.finished_at = _now()
+            with self._lock:
+                if job.key is not None and self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+        logger.info("Job %s (%s) %s", job.id, job.kind, job.status)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
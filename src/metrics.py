@@ -0,0 +1,231 @@
+"""
+Prometheus-style metrics (text exposition format 0.0.4) without extra dependencies.
+
+- http_request_duration_seconds{method,route,status}: recorded by
+  RequestMetricsMiddleware for every HTTP request, keyed by route template.
+- pipeline_stage_duration_seconds{pipeline,stage}: stage timers inside the
+  upload, consolidation and report pipelines (stage_timer / StreamTimer).
+- pipeline_rows_total{pipeline}: rows handled per pipeline, to relate stage
+  timings to monthly volumes.
+
+Upload stages: "parse" is decoding the request (JSON body before the handler
+runs, or reading CSV/XLSX rows), "validation" is checking records (pydantic
+models and the raw row builders' date / job number checks) and "insert" is
+the remaining bulk insert time.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key in sorted(self._series):
+                lines.extend(self._render_series(key, self._series[key]))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (non-cumulative) counts; the last slot is +Inf
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _render_series(self, key, series):
+        counts, total, count = series
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _labels(self.labelnames, key, (("le", _number(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_number(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")
+)
+STAGE_DURATION = Histogram(
+    "pipeline_stage_duration_seconds", "Time spent per pipeline stage.", ("pipeline", "stage")
+)
+PIPELINE_ROWS = Counter("pipeline_rows_total", "Rows handled per pipeline.", ("pipeline",))
+DEDUPLICATED_ROWS = Counter(
+    "pipeline_rows_deduplicated_total", "Uploaded rows not stored because nothing changed.", ("pipeline",)
+)
+
+
+def stage_timer(pipeline, stage):
+    """Context manager timing one stage of a pipeline run."""
+    return STAGE_DURATION.time(pipeline=pipeline, stage=stage)
+
+
+def observe_stage(pipeline, stage, seconds):
+    STAGE_DURATION.observe(seconds, pipeline=pipeline, stage=stage)
+
+
+class StreamTimer:
+    """
+    Stage timings for streamed pipelines, where stages are chained generators
+    consumed by the final stage (e.g. rows pulled by bulk_insert). Time spent
+    in next() of a wrapped iterator is charged to its stage, minus the time
+    charged to the wrapped iterators it pulls from.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self._inner = []
+
+    def wrap(self, iterable, stage):
+        self.totals.setdefault(stage, 0.0)
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            self._inner.append(0.0)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - started
+                inner = self._inner.pop()
+                self.totals[stage] += elapsed - inner
+                if self._inner:
+                    self._inner[-1] += elapsed
+            yield item
+
+    def total(self):
+        return sum(self.totals.values())
+
+    def observe(self, pipeline):
+        for stage, seconds in self.totals.items():
+            observe_stage(pipeline, stage, seconds)
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording request latency per route template and status."""
+
+    def __init__(self, app, histogram=REQUEST_DURATION):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        # Handlers read this to time what happens before they run (body decoding and validation)
+        scope.setdefault("state", {})["request_started"] = started
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            self.histogram.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", None) or "<unmatched>",
+                status=status["code"],
+            )
@@ -0,0 +1,198 @@
+"""
+Schema migrations, applied at startup.
+
+Migrations run once each, in order, and are recorded in `schema_migrations`.
+Migration 1 creates missing tables from the models, so a new database gets the
+current schema (indexes and foreign keys included) in one step; the later
+ones bring databases created before them up to date and leave a database that
+already has their changes untouched.
+"""
+import logging
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, TIMESTAMP, func, insert, inspect, null, select, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import AddConstraint
+
+import report_aggregates
+import retention
+import snapshots
+
+logger = logging.getLogger(__name__)
+
+# Serializes migrations across processes starting at the same time (PostgreSQL)
+MIGRATION_LOCK_KEY = 0x646F6C62
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255)),
+    Column("applied_at", TIMESTAMP, default=func.now()),
+)
+
+
+def create_tables(connection, metadata):
+    metadata.create_all(connection)
+
+
+def _has_columns(inspector, table, columns):
+    # Columns added by a later migration are not there yet when an older one runs
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    return all(column.name in existing for column in columns)
+
+
+def create_missing_indexes(connection, metadata):
+    """Create the declared indexes that an existing table does not have yet."""
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing and _has_columns(inspector, table, index.columns):
+                logger.info("Creating index %s on %s", index.name, table.name)
+                index.create(connection)
+
+
+def add_missing_columns(connection, metadata):
+    """ALTER TABLE ... ADD COLUMN for declared columns an existing table lacks (nullable ones only)."""
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable or column.server_default is not None:
+                raise RuntimeError(f"Cannot add {table.name}.{column.name}: only nullable columns are added")
+            logger.info("Adding column %s.%s", table.name, column.name)
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} {column_type}"
+            ))
+
+
+def compress_report_snapshots(connection, metadata):
+    """Move JSON report snapshots into compressed chunks (see snapshots.py)."""
+    history = metadata.tables["performance_report_generation_history"]
+    chunks = metadata.tables["report_snapshot_chunks"]
+    report_ids = connection.execute(
+        select(history.c.report_id).where(history.c.report_snapshot.isnot(None)).order_by(history.c.report_id)
+    ).scalars().all()
+    for report_id in report_ids:
+        rows = connection.execute(select(history.c.report_snapshot).where(history.c.report_id == report_id)).scalar()
+        rows = rows if isinstance(rows, list) else []
+        for chunk in snapshots.iter_chunks(report_id, rows):
+            connection.execute(insert(chunks).values(**chunk))
+        connection.execute(
+            update(history).where(history.c.report_id == report_id).values(report_snapshot=null(), row_count=len(rows))
+        )
+    if report_ids:
+        logger.info("Compressed %d report snapshots", len(report_ids))
+
+
+def build_report_aggregates(connection, metadata):
+    """Fill the report aggregates from the final tables (see report_aggregates.py)."""
+    tables = report_aggregates.ReportTables(*(
+        metadata.tables[name]
+        for name in ("report_project_aggregates", "erp_sales_final", "crm_projects_final", "data_code_raw")
+    ))
+    with Session(bind=connection) as db:
+        report_aggregates.rebuild(db, tables)
+
+
+def register_raw_table_months(connection, metadata):
+    """
+    Record the upload months of the raw tables in the partition catalog. The
+    tables themselves are left alone: partitioning rewrites them, so it is an
+    operator command (python retention.py partition), not a startup step.
+    """
+    catalog = metadata.tables["raw_table_partitions"]
+    uploads = metadata.tables["monthly_uploads"]
+    for upload_type, table_name in (("CRM", "crm_projects_raw"), ("ERP_Sales", "erp_sales_raw"), ("DataCode", "data_code_raw")):
+        months = {
+            retention.month_start(timestamp) for timestamp in connection.execute(
+                select(uploads.c.upload_timestamp)
+                .where(uploads.c.upload_type == upload_type, uploads.c.upload_timestamp.isnot(None))
+            ).scalars()
+        }
+        for month in sorted(months):
+            connection.execute(insert(catalog).values(table_name=table_name, month=month))
+
+
+def raw_row_page_indexes(connection, metadata):
+    """
+    (upload_id, id) indexes for paging through an upload's raw rows; on
+    data_code_raw it replaces the (upload_id) one.
+    """
+    create_missing_indexes(connection, metadata)
+    if "ix_data_code_raw_upload_id" in {index["name"] for index in inspect(connection).get_indexes("data_code_raw")}:
+        logger.info("Dropping index ix_data_code_raw_upload_id on data_code_raw")
+        connection.execute(text("DROP INDEX ix_data_code_raw_upload_id"))
+
+
+def add_missing_foreign_keys(connection, metadata):
+    """
+    Add the declared foreign keys that an existing table does not have yet.
+    SQLite cannot add constraints to an existing table, so there only new
+    databases get them.
+    """
+    dialect = connection.dialect.name
+    inspector = inspect(connection)
+    for table in metadata.sorted_tables:
+        existing = {fk["name"] for fk in inspector.get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            if constraint.name in existing or not _has_columns(inspector, table, constraint.columns):
+                continue
+            if dialect == "sqlite":
+                logger.info("Foreign key %s not added: SQLite cannot alter the existing %s table", constraint.name, table.name)
+                continue
+            logger.info("Adding foreign key %s on %s", constraint.name, table.name)
+            if dialect != "postgresql":
+                connection.execute(AddConstraint(constraint))
+                continue
+            # NOT VALID enforces the key for new rows without failing on rows already orphaned
+            ddl = str(AddConstraint(constraint).compile(dialect=connection.dialect))
+            connection.execute(text(f"{ddl} NOT VALID"))
+            try:
+                with connection.begin_nested():
+                    connection.execute(text(f'ALTER TABLE {table.name} VALIDATE CONSTRAINT "{constraint.name}"'))
+            except Exception as e:
+                logger.warning("Foreign key %s left unvalidated: existing rows violate it (%s)", constraint.name, e)
+
+
+# (version, description, fn(connection, metadata)); append only, never renumber
+MIGRATIONS = [
+    (1, "create tables", create_tables),
+    (2, "indexes on the consolidation and report access paths", create_missing_indexes),
+    (3, "upload_id foreign keys to monthly_uploads", add_missing_foreign_keys),
+    (4, "report snapshot chunks table", create_tables),
+    (5, "report row count and fiscal year columns", add_missing_columns),
+    (6, "compress stored report snapshots", compress_report_snapshots),
+    (7, "report project aggregates table", create_tables),
+    (8, "build report project aggregates", build_report_aggregates),
+    (9, "upload content hash and raw row hash columns", add_missing_columns),
+    (10, "DataCode row hash index", create_missing_indexes),
+    (11, "raw table partition catalog", create_tables),
+    (12, "raw table upload months", register_raw_table_months),
+    (13, "raw row page indexes", raw_row_page_indexes),
+    # Left NULL: the first consolidation afterwards folds in every upload once,
+    # including any the upload id watermark skipped
+    (14, "upload consolidated_at column", add_missing_columns),
+]
+
+
+def migrate(engine, metadata):
+    """Apply the pending migrations in one transaction; returns the versions applied."""
+    applied_now = []
+    with engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        schema_migrations.create(connection, checkfirst=True)
+        applied = set(connection.execute(select(schema_migrations.c.version)).scalars())
+        for version, description, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info("Applying schema migration %d: %s", version, description)
+            apply(connection, metadata)
+            connection.execute(insert(schema_migrations).values(version=version, description=description))
+            applied_now.append(version)
+    return applied_now
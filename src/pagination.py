@@ -0,0 +1,121 @@
+"""
+Keyset pagination, column projection and ETags for the read endpoints.
+
+A page is read as "the next `limit` rows after the cursor" on one unique,
+indexed key column (upload_id, id, report_id), so every page costs an index
+range scan however deep the client pages, and rows inserted meanwhile do not
+shift the pages. The cursor is the last key of the previous page, opaque to
+clients (urlsafe base64 JSON).
+
+The paged tables are append-only: rows are inserted with increasing keys
+and deleted (compaction), never updated. A page is therefore identified by
+the keys of its window, and its ETag is a hash of their count, range and
+sum (window_version), computed from the key index before any row is read:
+a client sending it back in If-None-Match gets an empty 304 without the page
+being read or serialized. The tags are weak, as they are not a hash of the
+bytes.
+"""
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+
+from sqlalchemy import func, select
+
+# Rows per page by default, and at most
+DEFAULT_PAGE_ROWS = 100
+MAX_PAGE_ROWS = 1000
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps([key]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The key a cursor points after; ValueError for anything encode_cursor did not produce."""
+    try:
+        key, = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if not isinstance(key, int):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return key
+
+
+def projection(fields, columns, key):
+    """
+    Names of the requested fields (comma separated; all of `columns` for
+    None), in `columns` order, always including the key. ValueError for
+    unknown names.
+    """
+    if fields is None:
+        return list(columns)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - columns.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields {sorted(unknown)}. Expected some of {list(columns)}.")
+    requested.add(key)
+    return [name for name in columns if name in requested]
+
+
+def _window(query, key_column, after, limit, descending):
+    # The page's rows and the first row of the next page, which tells whether there is one
+    if after is not None:
+        query = query.where(key_column < after if descending else key_column > after)
+    return query.order_by(key_column.desc() if descending else key_column).limit(limit + 1)
+
+
+def window_version_query(columns, key, criteria=(), after=None, limit=DEFAULT_PAGE_ROWS, descending=False):
+    """SELECT of the count, min, max and sum of the keys keyset_page would read with the same arguments."""
+    key_column = columns[key]
+    window = _window(select(key_column.label("key")).where(*criteria), key_column, after, limit, descending).subquery()
+    return select(func.count(), func.min(window.c.key), func.max(window.c.key), func.sum(window.c.key))
+
+
+def window_version(db, columns, key, criteria=(), after=None, limit=DEFAULT_PAGE_ROWS, descending=False):
+    """The page's version: changes whenever a row of the page is added or deleted."""
+    return tuple(db.execute(window_version_query(columns, key, criteria, after, limit, descending)).one())
+
+
+def keyset_page(db, columns, key, names, criteria=(), after=None, limit=DEFAULT_PAGE_ROWS, descending=False):
+    """
+    One page of rows as dicts of `names` (see projection), ordered by the
+    `key` column and starting after the key `after` (decode_cursor), and the
+    cursor of the next page (None on the last one). `columns` maps field
+    names to column expressions of one table.
+    """
+    key_column = columns[key]
+    query = _window(
+        select(*[columns[name].label(name) for name in names]).where(*criteria), key_column, after, limit, descending
+    )
+    rows = [dict(row) for row in db.execute(query).mappings()]
+    if len(rows) <= limit:
+        return rows, None
+    rows.pop()
+    return rows, encode_cursor(rows[-1][key])
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def json_body(payload):
+    return json.dumps(payload, default=_json_value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag(*version):
+    """Weak ETag of a page version: JSON-serializable parts such as the field names and window_version."""
+    return 'W/"' + hashlib.blake2b(json_body(version), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match, tag):
+    """Whether an If-None-Match header value names `tag` (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or tag.removeprefix("W/") in [candidate.removeprefix("W/") for candidate in candidates]
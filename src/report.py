@@ -0,0 +1,269 @@
+import logging
+import time
+
+from app_logging import RunStats, Sampler
+from dates import fiscal_year_range, to_date
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Report month columns in fiscal order; a row's month vector is indexed the same way
+FISCAL_MONTHS = (
+    "April", "May", "June", "July", "August", "September",
+    "October", "November", "December", "January", "February", "March",
+)
+# Fiscal month slot (April=0 .. March=11) by calendar month number
+FISCAL_SLOT = (None, 9, 10, 11, 0, 1, 2, 3, 4, 5, 6, 7, 8)
+
+
+class ReportRow:
+    """
+    One project's line while the report is accumulated: the twelve month
+    amounts live in a list indexed by fiscal slot. to_dict() gives the JSON
+    shape returned by the API.
+    """
+
+    __slots__ = ("parent_code", "customer_name", "project_name", "project_rank", "project_code", "months", "net_sales")
+
+    def __init__(self, parent_code, customer_name, project_name, project_rank, project_code):
+        self.parent_code = parent_code
+        self.customer_name = customer_name
+        self.project_name = project_name
+        self.project_rank = project_rank
+        self.project_code = project_code
+        self.months = [0] * 12
+        self.net_sales = 0
+
+    def add(self, slot, amount):
+        self.months[slot] += amount
+        self.net_sales += amount
+
+    def to_dict(self):
+        row = {
+            "Parent Code": self.parent_code,
+            "Customer Name": self.customer_name,
+            "Project Name": self.project_name,
+            "Project Rank": self.project_rank,
+            "Project Code": self.project_code,
+        }
+        row.update(zip(FISCAL_MONTHS, self.months))
+        row["Net sales amount"] = self.net_sales
+        return row
+
+
+def monthly_net_sales_slots(order_amount, billing_method, start_date, end_date, fiscal_year=None):
+    """
+    Distribute the order amount over the contract period as (fiscal slot,
+    amount) pairs, starting at the contract's first month. Dates may be
+    date / datetime objects or "%Y-%m-%d %H:%M:%S" strings.
+
+    Without a fiscal year, months are only told apart by name (April of every
+    year is one column). With one, only the billed months inside that fiscal
+    year are returned.
+    """
+    if not order_amount or not start_date or not end_date:
+        return []
+    try:
+        start_date = to_date(start_date)
+        end_date = to_date(end_date)
+        delta_months = (end_date.year - start_date.year) * 12 + (end_date.month - start_date.month) + 1
+        if delta_months <= 0:
+            return []
+        billing_method = int(billing_method) if billing_method and int(billing_method) > 0 else delta_months
+        billing_method = min(billing_method, delta_months)
+        monthly_net_sales = order_amount / billing_method
+        if fiscal_year is not None:
+            # Months counted from April of the fiscal year: slots 0-11 fall inside it
+            first = (start_date.year - fiscal_year) * 12 + start_date.month - 4
+            return [
+                (first + offset, monthly_net_sales)
+                for offset in range(max(0, -first), min(billing_method, 12 - first))
+            ]
+        first = FISCAL_SLOT[start_date.month]
+        # More than twelve billings land on the same month columns again, which keep one share each
+        return [((first + offset) % 12, monthly_net_sales) for offset in range(min(billing_method, 12))]
+    except Exception as e:
+        logger.debug("Error calculating monthly net sales: %s", e)
+        return []
+
+
+def calculate_monthly_net_sales(order_amount, billing_method, start_date, end_date, fiscal_year=None):
+    """
+    Distribute the order amount over the contract period: month name -> amount.
+    """
+    return {
+        FISCAL_MONTHS[slot]: amount
+        for slot, amount in monthly_net_sales_slots(order_amount, billing_method, start_date, end_date, fiscal_year)
+    }
+
+
+def in_date_range(value, date_range):
+    """Whether a date (or report datetime string) falls in [start, end); unparseable values do not."""
+    try:
+        return date_range[0] <= to_date(value) < date_range[1]
+    except (TypeError, ValueError):
+        return False
+
+
+def contract_overlaps(start_date, end_date, date_range):
+    """Whether a contract period touches [start, end); missing or unparseable dates do not."""
+    try:
+        return to_date(start_date) < date_range[1] and to_date(end_date) >= date_range[0]
+    except (TypeError, ValueError):
+        return False
+
+
+def extract_project_rank(phase: str) -> str:
+    """
+    Extracts the project rank from the phase string.
+    If the phase starts with "SA", returns "SA".
+    Otherwise, returns the first character (if in A-F) or defaults to "E",
+    as for a missing or blank phase.
+    """
+    phase = (phase or "").strip().upper()
+    if not phase:
+        return "E"
+    if phase.startswith("SA"):
+        return "SA"
+    # Otherwise, take the first character
+    rank = phase[0]
+    if rank in "ABCDEFSA":
+        return rank
+    return "E"
+
+
+def create_performance_report(zac_data, datacode_data, kintone_data, fiscal_year=None):
+    """
+    Report rows for every ERP job and eligible CRM project. With a fiscal year
+    only ERP sales dated inside it and CRM contracts overlapping it are
+    reported, and contract amounts are spread over that year's months only.
+    """
+    performance_report = {}
+    year_range = fiscal_year_range(fiscal_year) if fiscal_year is not None else None
+    stats = RunStats("performance report")
+    # Per-record diagnostics are sampled; errors are sampled at WARNING
+    trace = Sampler(logger)
+    warn = Sampler(logger, level=logging.WARNING)
+    logger.info(
+        "Generating performance report from %d ERP, %d DataCode and %d CRM rows",
+        len(zac_data), len(datacode_data), len(kintone_data),
+    )
+    # Build mapping from CRM final data: project_name -> phase (default "E")
+    phase_project_rank_mapping = {}
+    for item in kintone_data:
+        pname = item.get("project_name")
+        phase = item.get("phase", "E")
+        # Use our helper to extract rank from the phase string
+        phase_project_rank_mapping[pname] = extract_project_rank(phase)
+
+    # Build mapping from DataCode data once: project_name -> parent_code (first match wins)
+    parent_code_mapping = {}
+    for x in datacode_data:
+        parent_code_mapping.setdefault(x.get("project_name"), x.get("parent_code", ""))
+
+    # Process ERP (zac) data
+    stage_started = time.perf_counter()
+    for item in zac_data:
+        stats.rows_processed += 1
+        project_name = item.get("project_name")
+        job_no = item.get("job_no")
+        if not job_no or not str(job_no).strip():
+            stats.rows_skipped += 1
+            if trace.hit():
+                logger.debug("Skipping ERP record with empty job_no for project '%s'.", project_name)
+            continue
+        try:
+            project_code = f"{int(job_no):07d}"
+        except Exception as e:
+            stats.rows_skipped += 1
+            stats.errors += 1
+            if warn.hit():
+                logger.warning("Error converting job_no '%s' to project code: %s", job_no, e)
+            continue
+        if year_range is not None and not in_date_range(item.get("sales_date"), year_range):
+            stats.rows_skipped += 1
+            continue
+
+        row = performance_report.get(project_code)
+        if row is None:
+            row = performance_report[project_code] = ReportRow(
+                parent_code_mapping.get(project_name, ""),
+                item.get("client_name", ""),
+                project_name,
+                phase_project_rank_mapping.get(project_name, "E"),
+                project_code,
+            )
+            if trace.hit():
+                logger.debug("Created report entry for ERP project '%s' with code '%s'.", project_name, project_code)
+
+        sales_date = item.get("sales_date")
+        if sales_date:
+            try:
+                slot = FISCAL_SLOT[to_date(sales_date).month]
+                row.add(slot, float(item.get("operating_profit") or 0))
+            except Exception as e:
+                stats.errors += 1
+                if warn.hit():
+                    logger.warning("Error processing sales date for ERP project '%s': %s", project_name, e)
+
+    observe_stage("report_python", "erp_pass", time.perf_counter() - stage_started)
+
+    # Process CRM (kintone) final data
+    stage_started = time.perf_counter()
+    for item in kintone_data:
+        stats.rows_processed += 1
+        project_name = item.get("project_name")
+        try:
+            project_code = f"{int(item.get('project_id')):07d}"
+        except Exception as e:
+            stats.rows_skipped += 1
+            stats.errors += 1
+            if warn.hit():
+                logger.warning("Error converting CRM project id for '%s': %s", project_name, e)
+            continue
+        # Here high_potential_mark is now boolean
+        high_potential_mark = item.get("high_potential_mark")
+        phase = item.get("phase")
+        project_rank = extract_project_rank(phase) if phase else "E"
+        if trace.hit():
+            logger.debug("CRM: Project '%s', high potential: %s, rank: %s", project_name, high_potential_mark, project_rank)
+        # Now check using boolean: if high potential is True and rank in B-F, or rank is A
+        if (high_potential_mark is True and project_rank in ["B", "C", "D", "E", "F"]) or project_rank == "A":
+            if year_range is not None and not contract_overlaps(
+                item.get("contract_start_date"), item.get("contract_end_date"), year_range
+            ):
+                stats.rows_skipped += 1
+                continue
+            row = performance_report.get(project_code)
+            if row is None:
+                row = performance_report[project_code] = ReportRow(
+                    parent_code_mapping.get(project_name, ""),
+                    item.get("company_name", ""),
+                    project_name,
+                    project_rank,
+                    project_code,
+                )
+            try:
+                order_amount = (float(item.get("order_amount_net") or 0)) * 1000000
+                billing_method = item.get("billing_method")
+                cs = item.get("contract_start_date")
+                ce = item.get("contract_end_date")
+                if cs and ce:
+                    for slot, amount in monthly_net_sales_slots(order_amount, billing_method, cs, ce, fiscal_year):
+                        row.add(slot, amount)
+                elif trace.hit():
+                    logger.debug("CRM project '%s' missing contract dates.", project_name)
+            except Exception as e:
+                stats.errors += 1
+                if warn.hit():
+                    logger.warning("Error calculating monthly sales for CRM project '%s': %s", project_name, e)
+        else:
+            stats.rows_skipped += 1
+    observe_stage("report_python", "crm_pass", time.perf_counter() - stage_started)
+
+    stats.log(logger, report_rows=len(performance_report))
+    # Rows are released as they are serialized, so both shapes are never held in full
+    report_rows = []
+    for project_code in list(performance_report):
+        report_rows.append(performance_report.pop(project_code).to_dict())
+    return report_rows
@@ -0,0 +1,188 @@
+"""
+Materialized all-years report rows, maintained incrementally.
+
+The aggregate table holds the finished report row of every project: its
+descriptive fields, the twelve fiscal month amounts (ERP operating profit
+plus the CRM contract spread) and the net sales. The aggregate report engine
+reads it in one ordered scan instead of recomputing every project.
+
+Rows are computed with the SQL engine's passes (report_sql), restricted to
+the projects whose inputs changed:
+
+- consolidation: the ERP jobs and CRM projects in the consolidated uploads,
+  and the ERP jobs named like one of those CRM projects (before or after the
+  upload), since an ERP job takes its rank from the last CRM project with its
+  name;
+- DataCode uploads: the ERP jobs and CRM projects named in the upload, whose
+  parent code may change.
+
+rebuild() recomputes everything (full rebuilds, migrations, repairs) and
+check() compares the table with a full recompute.
+
+The functions take the tables as a ReportTables tuple. The aggregate table
+has these columns:
+    project_no (primary key), section, parent_code, customer_name,
+    project_name, project_rank, one per fiscal month (april .. march),
+    net_sales, updated_at
+"""
+import collections
+import logging
+
+from sqlalchemy import and_, delete, exists, insert, or_, select, text, union
+
+from report import FISCAL_MONTHS
+from report_sql import add_crm_report_rows, erp_report_rows
+
+logger = logging.getLogger(__name__)
+
+ReportTables = collections.namedtuple("ReportTables", "aggregates erp crm datacode")
+
+MONTH_COLUMNS = tuple(month.lower() for month in FISCAL_MONTHS)
+# Report order: ERP jobs by job_no, then the CRM-only projects by project_id
+ERP_SECTION, CRM_SECTION = 0, 1
+# Project numbers recomputed per statement (bound parameters per IN list)
+REFRESH_BATCH_PROJECTS = 2000
+# Serializes aggregate maintenance across concurrent transactions (PostgreSQL)
+AGGREGATE_LOCK_KEY = 0x646F6C63
+
+
+def _lock(db):
+    # Each refresh then reads the source rows committed by the one before it
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": AGGREGATE_LOCK_KEY})
+
+
+def _stored(value):
+    # The engines leave untouched months as the integer 0; NULL keeps that apart from 0.0
+    return None if type(value) is int else value
+
+
+def compute_rows(db, tables, project_numbers=None):
+    """Aggregate rows of the given projects (all of them for None), in report order."""
+    erp, crm = tables.erp, tables.crm
+    erp_criteria = [] if project_numbers is None else [erp.c.job_no.in_(project_numbers)]
+    crm_criteria = [] if project_numbers is None else [crm.c.project_id.in_(project_numbers)]
+    performance_report = erp_report_rows(db, erp, crm, tables.datacode, *erp_criteria)
+    erp_codes = set(performance_report)
+    add_crm_report_rows(db, crm, tables.datacode, performance_report, *crm_criteria)
+    rows = []
+    for project_code, entry in performance_report.items():
+        row = {
+            "project_no": int(project_code),
+            "section": ERP_SECTION if project_code in erp_codes else CRM_SECTION,
+            "parent_code": entry["Parent Code"],
+            "customer_name": entry["Customer Name"],
+            "project_name": entry["Project Name"],
+            "project_rank": entry["Project Rank"],
+            "net_sales": _stored(entry["Net sales amount"]),
+        }
+        for month, column in zip(FISCAL_MONTHS, MONTH_COLUMNS):
+            row[column] = _stored(entry[month])
+        rows.append(row)
+    return rows
+
+
+def _write(db, tables, rows):
+    if rows:
+        db.execute(insert(tables.aggregates), rows)
+
+
+def rebuild(db, tables):
+    """Recompute every project's row; returns the number of rows."""
+    _lock(db)
+    rows = compute_rows(db, tables)
+    db.execute(delete(tables.aggregates))
+    _write(db, tables, rows)
+    logger.info("Rebuilt report aggregates: %d projects", len(rows))
+    return len(rows)
+
+
+def refresh(db, tables, project_numbers):
+    """Recompute the rows of some projects (dropping those no longer reported); returns how many."""
+    _lock(db)
+    project_numbers = sorted(set(project_numbers))
+    for start in range(0, len(project_numbers), REFRESH_BATCH_PROJECTS):
+        batch = project_numbers[start:start + REFRESH_BATCH_PROJECTS]
+        rows = compute_rows(db, tables, batch)
+        db.execute(delete(tables.aggregates).where(tables.aggregates.c.project_no.in_(batch)))
+        _write(db, tables, rows)
+    return len(project_numbers)
+
+
+def consolidated_projects(db, tables, crm_raw, erp_raw, crm_upload_ids, erp_upload_ids):
+    """
+    Project numbers whose report row may change when the given raw uploads
+    are consolidated. Raw rows are append-only, so the names the CRM projects
+    had before are among the names of their other raw rows. A CRM project
+    without a name ranks the ERP jobs without one (report_sql.join_by_name).
+    """
+    crm_ids = select(crm_raw.c.project_id).where(
+        crm_raw.c.project_id.isnot(None), crm_raw.c.upload_id.in_(crm_upload_ids)
+    )
+    job_nos = select(erp_raw.c.job_no).where(erp_raw.c.job_no.isnot(None), erp_raw.c.upload_id.in_(erp_upload_ids))
+    names = select(crm_raw.c.project_name).where(crm_raw.c.project_id.in_(crm_ids))
+    erp = tables.erp
+    unnamed = exists(names.where(crm_raw.c.project_name.is_(None)))
+    ranked_jobs = select(erp.c.job_no).where(
+        or_(erp.c.project_name.in_(names), and_(erp.c.project_name.is_(None), unnamed))
+    )
+    return set(db.execute(union(crm_ids, job_nos, ranked_jobs)).scalars())
+
+
+def datacode_projects(db, tables, upload_id):
+    """Project numbers whose parent code may change with a DataCode upload."""
+    datacode, erp, crm = tables.datacode, tables.erp, tables.crm
+    names = select(datacode.c.project_name).where(datacode.c.upload_id == upload_id)
+    return set(db.execute(union(
+        select(erp.c.job_no).where(erp.c.project_name.in_(names)),
+        select(crm.c.project_id).where(crm.c.project_name.in_(names)),
+    )).scalars())
+
+
+def read_report(db, tables):
+    """The all-years report from the aggregate table, in report order."""
+    aggregates = tables.aggregates
+    query = select(
+        aggregates.c.parent_code, aggregates.c.customer_name, aggregates.c.project_name, aggregates.c.project_rank,
+        aggregates.c.project_no, *[aggregates.c[column] for column in MONTH_COLUMNS], aggregates.c.net_sales,
+    ).order_by(aggregates.c.section, aggregates.c.project_no)
+    amount_keys = (*FISCAL_MONTHS, "Net sales amount")
+    report = []
+    # Positional unpacking: attribute access per column costs more than the query
+    for parent_code, customer_name, project_name, project_rank, project_no, *amounts in db.execute(query):
+        entry = {
+            "Parent Code": parent_code,
+            "Customer Name": customer_name,
+            "Project Name": project_name,
+            "Project Rank": project_rank,
+            "Project Code": f"{project_no:07d}",
+        }
+        entry.update(zip(amount_keys, [0 if amount is None else amount for amount in amounts]))
+        report.append(entry)
+    return report
+
+
+def check(db, tables):
+    """
+    Compare the stored rows with a full recompute: project numbers missing
+    from the table, stored without being reported, or stored with other
+    values. The recompute uses the report_sql passes, so this catches missed
+    incremental refreshes; tests/test_report_equivalence.py holds those
+    passes to create_performance_report's rows.
+    """
+    columns = ("section", "parent_code", "customer_name", "project_name", "project_rank", *MONTH_COLUMNS, "net_sales")
+    expected = {row["project_no"]: tuple(row[c] for c in columns) for row in compute_rows(db, tables)}
+    stored = {
+        row.project_no: tuple(getattr(row, c) for c in columns)
+        for row in db.execute(select(tables.aggregates))
+    }
+    missing = sorted(expected.keys() - stored.keys())
+    unexpected = sorted(stored.keys() - expected.keys())
+    mismatched = sorted(n for n in expected.keys() & stored.keys() if expected[n] != stored[n])
+    return {
+        "consistent": not (missing or unexpected or mismatched),
+        "projects": len(expected),
+        "missing": missing,
+        "unexpected": unexpected,
+        "mismatched": mismatched,
+    }
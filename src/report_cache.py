@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+
+
+class ReportCache:
+    """
+    Small in-process LRU cache for generated reports.
+
+    Entries are keyed by a fingerprint of the data the report was built from,
+    so a stale entry is simply never looked up again; `invalidate()` drops
+    everything when a writer knows the data changed.
+    """
+
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
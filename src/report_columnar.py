@@ -0,0 +1,226 @@
+"""
+Columnar performance report engine (pandas/NumPy).
+
+Produces exactly the same list of report rows as report.create_performance_report,
+but does the fiscal-month bucketing, the CRM order-amount spreading and the
+per-project sums as array operations instead of per-record Python loops.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from dates import REPORT_DATETIME_FORMAT, fiscal_year_range
+from metrics import observe_stage
+from report import FISCAL_MONTHS, FISCAL_SLOT
+
+# report.FISCAL_SLOT as an array for fancy indexing by calendar month (index 0 unused)
+_FISCAL_INDEX_BY_CALENDAR_MONTH = np.array([0 if slot is None else slot for slot in FISCAL_SLOT])
+
+_RANK_LETTERS = set("ABCDEFSA")
+_HIGH_POTENTIAL_RANKS = ["B", "C", "D", "E", "F"]
+
+
+def _frame(data, columns):
+    """
+    Accept a DataFrame or a list of row dicts and guarantee the given columns
+    exist. Missing values of object columns (names, phases, codes) are None,
+    as in the row dicts of the Python engine, never NaN: NaN names would end
+    up in the report rows, which cannot be serialized as JSON.
+    """
+    # dtype=object keeps None as None (not NaN) so the "value or 0" rules still apply
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data), dtype=object)
+    for column in columns:
+        if column not in df.columns:
+            df[column] = None
+        elif pd.api.types.is_string_dtype(df[column]) and df[column].isna().any():
+            # pandas 3 reads text as the str dtype, which has no None: back to object first
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    return df.reset_index(drop=True)
+
+
+def _rank(phases):
+    """Vectorized extract_project_rank: 'SA', a letter from A-F/S, or 'E'."""
+    phase = phases.where(phases.map(lambda p: isinstance(p, str)), "").str.strip().str.upper()
+    first = phase.str[:1]
+    rank = first.where(first.isin(_RANK_LETTERS), "E")
+    rank = rank.where(~phase.str.startswith("SA"), "SA")
+    return rank.where(phase != "", "E")
+
+
+def _project_codes(values):
+    """Vectorized f"{int(value):07d}"; rows that would raise come back as None."""
+    if pd.api.types.is_integer_dtype(values) or pd.api.types.infer_dtype(values, skipna=False) == "integer":
+        return values.astype("int64").astype(str).str.zfill(7).astype(object)
+
+    def code(value):
+        try:
+            return f"{int(value):07d}"
+        except Exception:
+            return None
+
+    return values.map(code)
+
+
+def _to_timestamps(values):
+    """
+    Dates / datetimes convert directly, strings must match "%Y-%m-%d %H:%M:%S"
+    (as in the row-based engine). Anything else becomes NaT.
+    """
+    is_str = values.map(lambda v: isinstance(v, str))
+    stamps = pd.to_datetime(values.where(~is_str), errors="coerce")
+    if is_str.any():
+        stamps[is_str] = pd.to_datetime(values[is_str], format=REPORT_DATETIME_FORMAT, errors="coerce")
+    return stamps
+
+
+def _numbers(values):
+    """float(value or 0) for every row (NULLs count as 0); unparsable values become NaN."""
+    filled = values.where(values.notna() & values.map(bool), 0)
+    return pd.to_numeric(filled, errors="coerce").astype(float)
+
+
+def load_frame(db, table, *criteria):
+    """Read a table (optionally filtered) in primary key order straight into a DataFrame, skipping ORM instances."""
+    statement = select(table).where(*criteria).order_by(*table.primary_key.columns)
+    return pd.read_sql(statement, db.connection())
+
+
+def create_performance_report_columnar(zac_data, datacode_data, kintone_data, fiscal_year=None):
+    erp = _frame(zac_data, ["job_no", "project_name", "client_name", "sales_date", "operating_profit"])
+    crm = _frame(kintone_data, [
+        "project_id", "project_name", "company_name", "phase", "high_potential_mark",
+        "order_amount_net", "billing_method", "contract_start_date", "contract_end_date",
+    ])
+    datacode = _frame(datacode_data, ["project_name", "parent_code"])
+    year_start = year_end = None
+    if fiscal_year is not None:
+        year_start, year_end = (pd.Timestamp(d) for d in fiscal_year_range(fiscal_year))
+
+    # Lookup tables: project_name -> rank (last CRM row wins), -> parent code (first DataCode row wins)
+    crm_rank = _rank(crm["phase"])
+    rank_by_name = dict(zip(crm["project_name"], crm_rank))
+    first_codes = datacode.drop_duplicates("project_name", keep="first")
+    parent_by_name = dict(zip(first_codes["project_name"], first_codes["parent_code"]))
+
+    # ERP rows with a usable job_no
+    erp_codes = _project_codes(erp["job_no"])
+    erp_ok = erp["job_no"].map(lambda j: bool(j) and bool(str(j).strip())) & erp_codes.notna()
+    if fiscal_year is not None:
+        sales_dates = _to_timestamps(erp["sales_date"])
+        erp_ok &= ((sales_dates >= year_start) & (sales_dates < year_end)).to_numpy()
+    erp = erp[erp_ok.to_numpy()]
+    erp_codes = erp_codes[erp_ok]
+
+    # CRM rows that qualify: rank A, or high potential with rank B-F
+    crm_codes = _project_codes(crm["project_id"])
+    high_potential = crm["high_potential_mark"].map(lambda v: v is True or v is np.True_)
+    crm_ok = crm_codes.notna() & (
+        (high_potential & crm_rank.isin(_HIGH_POTENTIAL_RANKS)) | (crm_rank == "A")
+    )
+    if fiscal_year is not None:
+        starts = _to_timestamps(crm["contract_start_date"])
+        ends = _to_timestamps(crm["contract_end_date"])
+        crm_ok &= ((starts < year_end) & (ends >= year_start)).to_numpy()
+    crm = crm[crm_ok.to_numpy()]
+    crm_rank = crm_rank[crm_ok]
+    crm_codes = crm_codes[crm_ok]
+
+    # Report rows in first-seen order: ERP projects, then CRM-only projects
+    all_codes = pd.concat([erp_codes, crm_codes], ignore_index=True)
+    first_seen = ~all_codes.duplicated(keep="first")
+    header_codes = all_codes[first_seen].to_numpy()
+    row_of = {code: i for i, code in enumerate(header_codes)}
+
+    n_erp = len(erp_codes)
+    seen_positions = np.flatnonzero(first_seen.to_numpy())
+    names = np.concatenate([erp["project_name"].to_numpy(), crm["project_name"].to_numpy()])
+    customers = np.concatenate([erp["client_name"].to_numpy(), crm["company_name"].to_numpy()])
+    crm_ranks = crm_rank.to_numpy()
+    headers = []
+    for position in seen_positions:
+        name = names[position]
+        rank = rank_by_name.get(name, "E") if position < n_erp else crm_ranks[position - n_erp]
+        headers.append((parent_by_name.get(name, ""), customers[position], name, rank))
+
+    months = np.zeros((len(header_codes), 12))
+    touched = np.zeros((len(header_codes), 12), dtype=bool)
+    net = np.zeros(len(header_codes))
+    net_touched = np.zeros(len(header_codes), dtype=bool)
+
+    # ERP: operating profit bucketed by the sales date's month
+    stage_started = time.perf_counter()
+    sales_dates = _to_timestamps(erp["sales_date"])
+    profit = _numbers(erp["operating_profit"])
+    valid = (sales_dates.notna() & profit.notna()).to_numpy()
+    rows = erp_codes.map(row_of).to_numpy()[valid]
+    cols = _FISCAL_INDEX_BY_CALENDAR_MONTH[sales_dates.dt.month.to_numpy()[valid].astype(int)]
+    amounts = profit.to_numpy()[valid]
+    np.add.at(months, (rows, cols), amounts)
+    np.add.at(net, rows, amounts)
+    touched[rows, cols] = True
+    net_touched[rows] = True
+
+    observe_stage("report_columnar", "erp_pass", time.perf_counter() - stage_started)
+
+    # CRM: order amount (millions) spread evenly over the billed months from contract start
+    stage_started = time.perf_counter()
+    starts = _to_timestamps(crm["contract_start_date"])
+    ends = _to_timestamps(crm["contract_end_date"])
+    order = _numbers(crm["order_amount_net"]) * 1000000
+    delta = (
+        (ends.dt.year - starts.dt.year) * 12 + (ends.dt.month - starts.dt.month) + 1
+    ).to_numpy()
+    billing = pd.to_numeric(crm["billing_method"], errors="coerce").to_numpy()
+    billing = np.where(np.isfinite(billing) & (billing >= 1), np.trunc(np.nan_to_num(billing)), delta)
+    billing = np.minimum(billing, delta)
+    spread = (
+        starts.notna() & ends.notna() & order.notna() & (order != 0)
+    ).to_numpy() & (delta > 0)
+
+    billing = billing[spread].astype(int)
+    per_month = order.to_numpy()[spread] / billing
+    if fiscal_year is None:
+        # Month names repeat after a year, so at most 12 distinct months receive the amount
+        count = np.minimum(billing, 12)
+    else:
+        count = billing
+    repeated = np.repeat(np.arange(len(count)), count)
+    offsets = np.arange(len(repeated)) - np.repeat(np.cumsum(count) - count, count)
+    rows = crm_codes.map(row_of).to_numpy()[spread][repeated]
+    amounts = per_month[repeated]
+    if fiscal_year is None:
+        calendar_month = (starts.dt.month.to_numpy()[spread].astype(int)[repeated] - 1 + offsets) % 12 + 1
+        cols = _FISCAL_INDEX_BY_CALENDAR_MONTH[calendar_month]
+    else:
+        # Months counted from April of the fiscal year; only 0-11 fall inside it
+        first = (
+            (starts.dt.year.to_numpy()[spread].astype(int) - fiscal_year) * 12
+            + starts.dt.month.to_numpy()[spread].astype(int) - 4
+        )
+        cols = first[repeated] + offsets
+        inside = (cols >= 0) & (cols < 12)
+        rows, cols, amounts = rows[inside], cols[inside], amounts[inside]
+    np.add.at(months, (rows, cols), amounts)
+    np.add.at(net, rows, amounts)
+    touched[rows, cols] = True
+    net_touched[rows] = True
+    observe_stage("report_columnar", "crm_pass", time.perf_counter() - stage_started)
+
+    # Untouched cells stay the integer 0 the row-based engine starts from
+    report = []
+    for i, code in enumerate(header_codes):
+        parent_code, customer, name, rank = headers[i]
+        row = {
+            "Parent Code": parent_code,
+            "Customer Name": customer,
+            "Project Name": name,
+            "Project Rank": rank,
+            "Project Code": code,
+        }
+        for j, month in enumerate(FISCAL_MONTHS):
+            row[month] = float(months[i, j]) if touched[i, j] else 0
+        row["Net sales amount"] = float(net[i]) if net_touched[i] else 0
+        report.append(row)
+    return report
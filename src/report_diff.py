@@ -0,0 +1,114 @@
+"""
+Differences between two report snapshots, keyed by "Project Code".
+
+A hash join: the older report is indexed by project code, keeping only its
+descriptive fields and month amounts, and the newer one is streamed past
+that index. Each newer row either pairs with an older one (which is dropped
+from the index) or is added; whatever is left in the index was removed. Only
+the older report's index is held in memory, never both reports.
+
+Rows are the report's JSON shape (see ReportRow.to_dict), so the functions
+take any iterables of them, e.g. snapshots.iter_rows. Most projects are
+usually unchanged, and are told apart by comparing the raw values before any
+arithmetic.
+"""
+from operator import itemgetter
+
+from report import FISCAL_MONTHS
+
+KEY_FIELD = "Project Code"
+DESCRIPTIVE_FIELDS = ("Parent Code", "Customer Name", "Project Name", "Project Rank")
+NET_SALES_FIELD = "Net sales amount"
+# Amount differences at or below this are float noise, not changes
+AMOUNT_TOLERANCE = 1e-6
+
+_descriptive = itemgetter(*DESCRIPTIVE_FIELDS)
+_amounts = itemgetter(*FISCAL_MONTHS)
+
+
+def _row(code, fields, amounts, net_sales):
+    row = dict(zip(DESCRIPTIVE_FIELDS, fields))
+    row[KEY_FIELD] = code
+    row.update(zip(FISCAL_MONTHS, amounts))
+    row[NET_SALES_FIELD] = net_sales
+    return row
+
+
+def diff_reports(old_rows, new_rows, tolerance=AMOUNT_TOLERANCE):
+    """
+    {"added": [...], "removed": [...], "changed": [...], "summary": {...}}.
+    Added and removed projects are their report rows; a changed project has
+    its descriptive fields from the newer report, the fields that changed
+    ("changes": field -> {"old", "new"}), the months whose amount moved
+    ("month_deltas": month -> new - old) and the net sales before and after.
+    """
+    index = {}
+    old_total = 0.0
+    for row in old_rows:
+        net_sales = row[NET_SALES_FIELD]
+        old_total += net_sales
+        index[row[KEY_FIELD]] = (_descriptive(row), _amounts(row), net_sales)
+
+    added, changed = [], []
+    unchanged = 0
+    new_total = 0.0
+    month_totals = [0.0] * len(FISCAL_MONTHS)
+    for row in new_rows:
+        code = row[KEY_FIELD]
+        amounts = _amounts(row)
+        net_sales = row[NET_SALES_FIELD]
+        new_total += net_sales
+        old = index.pop(code, None)
+        if old is None:
+            added.append(row)
+            for slot, amount in enumerate(amounts):
+                month_totals[slot] += amount
+            continue
+        fields = _descriptive(row)
+        if old == (fields, amounts, net_sales):
+            unchanged += 1
+            continue
+        old_fields, old_amounts, old_net_sales = old
+        changes = {
+            name: {"old": before, "new": after}
+            for name, before, after in zip(DESCRIPTIVE_FIELDS, old_fields, fields)
+            if before != after
+        }
+        month_deltas = {}
+        for slot, (before, after) in enumerate(zip(old_amounts, amounts)):
+            if abs(after - before) > tolerance:
+                month_deltas[FISCAL_MONTHS[slot]] = after - before
+                month_totals[slot] += after - before
+        if not changes and not month_deltas and abs(net_sales - old_net_sales) <= tolerance:
+            unchanged += 1
+            continue
+        entry = dict(zip(DESCRIPTIVE_FIELDS, fields))
+        entry[KEY_FIELD] = code
+        entry["changes"] = changes
+        entry["month_deltas"] = month_deltas
+        entry["net_sales_old"] = old_net_sales
+        entry["net_sales_new"] = net_sales
+        entry["net_sales_delta"] = net_sales - old_net_sales
+        changed.append(entry)
+
+    removed = []
+    for code, (fields, amounts, net_sales) in index.items():
+        removed.append(_row(code, fields, amounts, net_sales))
+        for slot, amount in enumerate(amounts):
+            month_totals[slot] -= amount
+
+    return {
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "summary": {
+            "added": len(added),
+            "removed": len(removed),
+            "changed": len(changed),
+            "unchanged": unchanged,
+            "net_sales_old": old_total,
+            "net_sales_new": new_total,
+            "net_sales_delta": new_total - old_total,
+            "month_deltas": dict(zip(FISCAL_MONTHS, month_totals)),
+        },
+    }
@@ -0,0 +1,204 @@
+"""
+Server-side performance report engine.
+
+The ERP monthly operating-profit pivot, the DataCode parent-code lookup and the
+CRM rank / eligibility rules run as SQL, so only one aggregated row per ERP
+job and the narrow list of eligible CRM projects are read back. The CRM
+order-amount spreading reuses calculate_monthly_net_sales on those rows.
+"""
+import time
+
+from sqlalchemy import and_, case, extract, func, or_, select
+
+from dates import fiscal_year_range
+from metrics import observe_stage
+from report import FISCAL_MONTHS, FISCAL_SLOT, calculate_monthly_net_sales
+
+# Report month columns by calendar month number, in fiscal order (see report.FISCAL_SLOT)
+MONTH_NAMES = {FISCAL_SLOT.index(slot): month for slot, month in enumerate(FISCAL_MONTHS)}
+
+
+def rank_expression(phase):
+    """SQL version of extract_project_rank: 'SA', a letter from A-F/S, or 'E'."""
+    normalized = func.upper(func.trim(phase))
+    first = func.substr(normalized, 1, 1)
+    return case(
+        (normalized.like("SA%"), "SA"),
+        (first.in_(list("ABCDEFS")), first),
+        else_="E",
+    )
+
+
+def join_by_name(from_clause, project_name, table, pick, key, name):
+    """
+    LEFT JOIN onto from_clause the `key` that `pick` (func.min / func.max)
+    selects among the rows of `table` named project_name; returns the new
+    FROM clause and the key column (NULL without a match). A NULL name
+    matches the rows without a name, as the Python engine's dict lookups do.
+    Those are joined separately so the name join stays an equality, which
+    the database can hash or serve from the (project_name, ...) index.
+    """
+    named = (
+        select(table.c.project_name, pick(table.c[key]).label(key))
+        .where(table.c.project_name.isnot(None))
+        .group_by(table.c.project_name)
+        .subquery(name)
+    )
+    unnamed = select(pick(table.c[key]).label(key)).where(table.c.project_name.is_(None)).subquery(f"{name}_unnamed")
+    from_clause = from_clause.outerjoin(named, named.c.project_name == project_name).outerjoin(
+        unnamed, project_name.is_(None)
+    )
+    return from_clause, func.coalesce(named.c[key], unnamed.c[key])
+
+
+def join_parent_code(from_clause, project_name, datacode):
+    """
+    LEFT JOIN the first DataCode row for project_name onto from_clause.
+    Returns the new FROM clause and the "Parent Code" column: "" without a
+    match, the (possibly NULL) parent code with one, as in the Python engine.
+
+    The lookups join a grouped subquery and then the base table by primary
+    key, which lets the database hash/auto-index the grouped side.
+    """
+    from_clause, first_id = join_by_name(from_clause, project_name, datacode, func.min, "id", "first_datacode")
+    parent = datacode.alias("parent_datacode")
+    from_clause = from_clause.outerjoin(parent, parent.c.id == first_id)
+    column = case((parent.c.id.isnot(None), parent.c.parent_code), else_="").label("parent_code")
+    return from_clause, column
+
+
+def fiscal_year_criteria(erp, crm, fiscal_year):
+    """
+    Range predicates restricting the ERP sales / CRM contracts to a fiscal
+    year ([] without one), written so indexes on the date columns apply.
+    """
+    if fiscal_year is None:
+        return [], []
+    start, end = fiscal_year_range(fiscal_year)
+    return (
+        [erp.c.sales_date >= start, erp.c.sales_date < end],
+        [crm.c.contract_start_date < end, crm.c.contract_end_date >= start],
+    )
+
+
+def erp_monthly_query(erp, crm, datacode, *criteria):
+    """One row per ERP job with its operating profit pivoted into month columns."""
+    month = extract("month", erp.c.sales_date)
+    profit = func.coalesce(erp.c.operating_profit, 0)
+    month_sums = [
+        func.sum(case((month == number, profit))).label(name) for number, name in MONTH_NAMES.items()
+    ]
+    net = func.sum(case((erp.c.sales_date.isnot(None), profit))).label("net_sales")
+    # Aggregate first, then join the lookups onto one row per job
+    sums = (
+        select(erp.c.job_no, erp.c.client_name, erp.c.project_name, *month_sums, net)
+        .where(erp.c.job_no.isnot(None), erp.c.job_no != 0, *criteria)
+        .group_by(erp.c.job_no, erp.c.client_name, erp.c.project_name)
+        .subquery("erp_monthly")
+    )
+    from_clause, parent_code = join_parent_code(sums, sums.c.project_name, datacode)
+
+    # Rank comes from the last CRM project sharing the project name
+    from_clause, last_id = join_by_name(from_clause, sums.c.project_name, crm, func.max, "project_id", "last_crm")
+    ranked = crm.alias("rank_crm")
+    from_clause = from_clause.outerjoin(ranked, ranked.c.project_id == last_id)
+    return (
+        select(sums, parent_code, rank_expression(ranked.c.phase).label("project_rank"))
+        .select_from(from_clause)
+        .order_by(sums.c.job_no)
+    )
+
+
+def eligible_crm_query(crm, datacode, *criteria):
+    """CRM projects that enter the report: rank A, or high potential with rank B-F."""
+    from_clause, parent_code = join_parent_code(crm, crm.c.project_name, datacode)
+    rank = rank_expression(crm.c.phase)
+    return (
+        select(
+            crm.c.project_id,
+            crm.c.company_name,
+            crm.c.project_name,
+            parent_code,
+            rank.label("project_rank"),
+            crm.c.order_amount_net,
+            crm.c.billing_method,
+            crm.c.contract_start_date,
+            crm.c.contract_end_date,
+        )
+        .select_from(from_clause)
+        .where(
+            crm.c.project_id.isnot(None),
+            or_(
+                and_(crm.c.high_potential_mark.is_(True), rank.in_(["B", "C", "D", "E", "F"])),
+                rank == "A",
+            ),
+            *criteria,
+        )
+        .order_by(crm.c.project_id)
+    )
+
+
+def _report_row(parent_code, customer_name, project_name, project_rank, project_code):
+    row = {
+        "Parent Code": parent_code,
+        "Customer Name": customer_name,
+        "Project Name": project_name,
+        "Project Rank": project_rank or "E",
+        "Project Code": project_code,
+    }
+    for name in MONTH_NAMES.values():
+        row[name] = 0
+    row["Net sales amount"] = 0
+    return row
+
+
+def erp_report_rows(db, erp, crm, datacode, *criteria):
+    """project_code -> report row for the ERP jobs, in job_no order."""
+    performance_report = {}
+    for row in db.execute(erp_monthly_query(erp, crm, datacode, *criteria)).mappings():
+        project_code = f"{int(row['job_no']):07d}"
+        entry = _report_row(
+            row["parent_code"], row["client_name"], row["project_name"], row["project_rank"], project_code
+        )
+        # NULL sums mean no sales in that month: keep the integer 0 like the Python engine
+        for name in MONTH_NAMES.values():
+            if row[name] is not None:
+                entry[name] = float(row[name])
+        if row["net_sales"] is not None:
+            entry["Net sales amount"] = float(row["net_sales"])
+        performance_report[project_code] = entry
+    return performance_report
+
+
+def add_crm_report_rows(db, crm, datacode, performance_report, *criteria, fiscal_year=None):
+    """Spread the eligible CRM projects into performance_report, adding rows for those without one."""
+    for row in db.execute(eligible_crm_query(crm, datacode, *criteria)).mappings():
+        project_code = f"{int(row['project_id']):07d}"
+        if project_code not in performance_report:
+            performance_report[project_code] = _report_row(
+                row["parent_code"], row["company_name"], row["project_name"], row["project_rank"], project_code
+            )
+        start, end = row["contract_start_date"], row["contract_end_date"]
+        if not (start and end):
+            continue
+        order_amount = float(row["order_amount_net"] or 0) * 1000000
+        monthly_sales = calculate_monthly_net_sales(order_amount, row["billing_method"], start, end, fiscal_year)
+        entry = performance_report[project_code]
+        for month, amount in monthly_sales.items():
+            entry[month] += amount
+            entry["Net sales amount"] += amount
+    return performance_report
+
+
+def create_performance_report_sql(db, erp, crm, datacode, fiscal_year=None):
+    erp_criteria, crm_criteria = fiscal_year_criteria(erp, crm, fiscal_year)
+
+    stage_started = time.perf_counter()
+    performance_report = erp_report_rows(db, erp, crm, datacode, *erp_criteria)
+    observe_stage("report_sql", "erp_pass", time.perf_counter() - stage_started)
+
+    stage_started = time.perf_counter()
+    add_crm_report_rows(db, crm, datacode, performance_report, *crm_criteria, fiscal_year=fiscal_year)
+    observe_stage("report_sql", "crm_pass", time.perf_counter() - stage_started)
+
+    return list(performance_report.values())
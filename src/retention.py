@@ -0,0 +1,331 @@
+"""
+Partitioning, archiving and compaction of the raw upload tables.
+
+Raw rows carry their upload's timestamp (record_timestamp), and the raw
+tables are split by upload month:
+
+- PostgreSQL: once an operator runs `python retention.py partition` (it
+  rewrites the tables, see partition_table), the tables are partitioned by
+  RANGE (record_timestamp), one partition per month (<table>_pYYYYMM) plus a
+  default partition. Uploads only record their month in the catalog; the
+  compaction job and `python retention.py create-partitions` create the
+  partitions of this month and the next ones ahead of them, and compaction
+  drops the months it emptied.
+- other databases (SQLite), and PostgreSQL tables not partitioned yet: the
+  tables stay as they are and the months only exist in the partition catalog,
+  which both keep.
+
+Consolidation and the report only read the newest raw row per key (CRM
+project_id, ERP job_no) and the first DataCode row per project name, so the
+other rows are history. Compaction moves the superseded rows of old uploads
+into gzip-compressed NDJSON archives, one file per upload and run:
+
+    <archive dir>/<table>/upload-<upload_id>.<run>.ndjson.gz
+
+A CRM / ERP row is superseded when a newer row with its key belongs to an
+upload consolidated already, so the rows consolidation and deduplication
+compare with are never removed. An archive is written under a
+.tmp name and renamed once the delete of its rows is committed; a failed run
+leaves at worst a .tmp file holding rows that are still in the table.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import os
+
+from sqlalchemy import delete, exists, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.schema import AddConstraint
+
+from ingest import iter_batches
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted per statement (bound parameters per IN list)
+DELETE_BATCH_ROWS = 1000
+# gzip's default (9) costs about twice the time for a few percent smaller archives
+COMPRESSION_LEVEL = 6
+# Partition catalog inserts that leave an existing month alone
+_INSERT_IGNORE = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def months_before(month, count):
+    """The first day of the month `count` months before `month`."""
+    index = month.year * 12 + month.month - 1 - count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table.name}_p{month:%Y%m}"
+
+
+def _is_postgresql(db):
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _register(db, catalog, table, month):
+    # Concurrent uploads may both register a new month
+    make_insert = _INSERT_IGNORE.get(db.get_bind().dialect.name)
+    if make_insert is None:
+        db.execute(insert(catalog).values(table_name=table.name, month=month))
+    else:
+        db.execute(make_insert(catalog).values(table_name=table.name, month=month).on_conflict_do_nothing())
+
+
+def register_month(db, catalog, table, timestamp):
+    """
+    Record the month of `timestamp` in the partition catalog (in the current
+    transaction). No DDL: rows of a month without its partition go to the
+    default partition until create_partition moves them.
+    """
+    month = month_start(timestamp)
+    entry = db.execute(select(catalog.c.dropped_at).where(
+        catalog.c.table_name == table.name, catalog.c.month == month
+    )).first()
+    if entry is None:
+        _register(db, catalog, table, month)
+    elif entry.dropped_at is not None:
+        db.execute(catalog.update().where(
+            catalog.c.table_name == table.name, catalog.c.month == month
+        ).values(dropped_at=None))
+    return month
+
+
+def is_partitioned(db, table):
+    """Whether `table` is a partitioned PostgreSQL table (partition_table ran on it)."""
+    if not _is_postgresql(db):
+        return False
+    return db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"
+    ), {"name": table.name}).first() is not None
+
+
+def create_partition(db, table, month):
+    """
+    PostgreSQL: add the partition of `month` to a partitioned raw table, moving
+    that month's rows out of the default partition. Takes an ACCESS EXCLUSIVE
+    lock on the table until commit, so it runs in the jobs and commands, not in
+    uploads. Returns whether a partition was created.
+    """
+    if not is_partitioned(db, table):
+        return False
+    name = partition_name(table, month)
+    if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return False
+    preparer = db.get_bind().dialect.identifier_preparer
+    parent, partition = preparer.format_table(table), preparer.quote(name)
+    bounds = f"FROM ('{month}') TO ('{next_month(month)}')"
+    default = preparer.quote(f"{table.name}_pdefault")
+    in_month = f"record_timestamp >= '{month}' AND record_timestamp < '{next_month(month)}'"
+    if db.execute(text(f"SELECT 1 FROM {default} WHERE {in_month} LIMIT 1")).first() is None:
+        db.execute(text(f"CREATE TABLE {partition} PARTITION OF {parent} FOR VALUES {bounds}"))
+    else:
+        # A partition cannot be created over rows the default partition holds
+        db.execute(text(f"CREATE TABLE {partition} (LIKE {parent} INCLUDING DEFAULTS)"))
+        columns = ", ".join(preparer.format_column(column) for column in table.columns)
+        moved = db.execute(text(
+            f"WITH moved AS (DELETE FROM {default} WHERE {in_month} RETURNING {columns}) "
+            f"INSERT INTO {partition} ({columns}) SELECT {columns} FROM moved"
+        )).rowcount
+        db.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {partition} FOR VALUES {bounds}"))
+        logger.info("Moved %d rows of %s from the default partition to %s", moved, month, name)
+    return True
+
+
+def ensure_partitions(db, catalog, table, months):
+    """Register `months` and create their partitions (PostgreSQL); returns the months whose partition is new."""
+    created = []
+    for month in months:
+        register_month(db, catalog, table, month)
+        if create_partition(db, table, month):
+            created.append(month)
+    return created
+
+
+def upcoming_months(today, ahead):
+    """The month of `today` and the `ahead` months after it."""
+    months = [month_start(today)]
+    for _ in range(ahead):
+        months.append(next_month(months[-1]))
+    return months
+
+
+def partition_table(connection, table, months):
+    """
+    PostgreSQL: rebuild a raw table as partitioned by upload month, with its
+    rows, indexes and foreign keys, a partition per month of `months` or of
+    its rows, and a default one. The primary key becomes
+    (id, record_timestamp) as partitioned tables require; rows without a
+    timestamp take their upload's. Rewrites the whole table under an ACCESS
+    EXCLUSIVE lock: an operator command (see main), never run at startup.
+    Returns the months partitioned.
+    """
+    preparer = connection.dialect.identifier_preparer
+    name = preparer.format_table(table)
+    old = preparer.quote(f"{table.name}_unpartitioned")
+    connection.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (record_timestamp)"))
+    connection.execute(text(
+        f"UPDATE {old} SET record_timestamp = COALESCE("
+        f"(SELECT upload_timestamp FROM monthly_uploads WHERE monthly_uploads.upload_id = {old}.upload_id), now()) "
+        f"WHERE record_timestamp IS NULL"
+    ))
+    months = set(months) | {
+        month_start(value) for value in connection.execute(
+            text(f"SELECT DISTINCT date_trunc('month', record_timestamp) FROM {old}")
+        ).scalars()
+    }
+    for month in sorted(months):
+        connection.execute(text(
+            f"CREATE TABLE {preparer.quote(partition_name(table, month))} PARTITION OF {name} "
+            f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+        ))
+    connection.execute(text(f"CREATE TABLE {preparer.quote(table.name + '_pdefault')} PARTITION OF {name} DEFAULT"))
+    columns = ", ".join(preparer.format_column(column) for column in table.columns)
+    connection.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {old}"))
+    # The id sequence belongs to the old table's column until it is handed over
+    sequence = connection.execute(text(f"SELECT pg_get_serial_sequence('{table.name}_unpartitioned', 'id')")).scalar()
+    if sequence is not None:
+        connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {name}.id"))
+    connection.execute(text(f"DROP TABLE {old}"))
+    # Index and constraint names are free again once the old table is gone
+    connection.execute(text(f"ALTER TABLE {name} ADD PRIMARY KEY (id, record_timestamp)"))
+    for index in table.indexes:
+        index.create(connection)
+    for constraint in table.foreign_key_constraints:
+        connection.execute(AddConstraint(constraint))
+    logger.info("Partitioned %s by upload month: %d partitions", table.name, len(months))
+    return sorted(months)
+
+
+def superseded(raw_table, key, newest_wins, consolidated=None):
+    """
+    Criteria for the raw rows another row with the same key overrides: a newer
+    one from an upload in `consolidated` (a SELECT of upload ids) when
+    newest_wins (CRM, ERP), an older one otherwise (DataCode, first row per
+    name).
+    """
+    other = raw_table.alias("overriding")
+    if newest_wins:
+        overriding = [other.c.id > raw_table.c.id]
+        if consolidated is not None:
+            overriding.append(other.c.upload_id.in_(consolidated))
+    else:
+        overriding = [other.c.id < raw_table.c.id]
+    return [raw_table.c[key].isnot(None), exists().where(other.c[key] == raw_table.c[key], *overriding)]
+
+
+def _archive_value(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else str(value)
+
+
+def compact_upload(db, raw_table, key, newest_wins, upload_id, archive_dir, run, consolidated=None):
+    """
+    Archive and delete the superseded rows of one upload (in the current
+    transaction). Returns the number of rows and the archive's .tmp path
+    (None without rows): the caller commits, then calls publish_archive.
+    """
+    query = (
+        select(raw_table)
+        .where(raw_table.c.upload_id == upload_id, *superseded(raw_table, key, newest_wins, consolidated))
+        .order_by(raw_table.c.id)
+    )
+    directory = os.path.join(archive_dir, raw_table.name)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"upload-{upload_id:06d}.{run}.ndjson.gz.tmp")
+    ids = []
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=COMPRESSION_LEVEL) as archive:
+        for row in db.execute(query).mappings():
+            archive.write(json.dumps(dict(row), default=_archive_value, ensure_ascii=False, separators=(",", ":")) + "\n")
+            ids.append(row["id"])
+    if not ids:
+        os.remove(path)
+        return 0, None
+    for batch in iter_batches(ids, DELETE_BATCH_ROWS):
+        db.execute(delete(raw_table).where(raw_table.c.id.in_(batch)))
+    return len(ids), path
+
+
+def publish_archive(path):
+    """Give a committed archive its final name."""
+    if path is not None:
+        os.replace(path, path[:-len(".tmp")])
+
+
+def discard_archive(path):
+    """Remove the archive of a rolled back compaction (its rows are still in the table)."""
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+
+
+def drop_empty_partitions(db, catalog, table, uploads, before):
+    """
+    Drop the months before `before` whose uploads (upload_id, upload_timestamp
+    pairs of the table's upload type) no longer have rows. Returns the months.
+    """
+    months = db.execute(select(catalog.c.month).where(
+        catalog.c.table_name == table.name, catalog.c.month < before, catalog.c.dropped_at.is_(None)
+    ).order_by(catalog.c.month)).scalars().all()
+    dropped = []
+    preparer = db.get_bind().dialect.identifier_preparer
+    for month in months:
+        upload_ids = [
+            upload_id for upload_id, timestamp in uploads if timestamp is not None and month_start(timestamp) == month
+        ]
+        if upload_ids and db.execute(
+            select(table.c.id).where(table.c.upload_id.in_(upload_ids)).limit(1)
+        ).first() is not None:
+            continue
+        if _is_postgresql(db):
+            partition = preparer.quote(partition_name(table, month))
+            if db.execute(text(f"SELECT to_regclass('{partition_name(table, month)}')")).scalar() is not None:
+                if db.execute(text(f"SELECT 1 FROM {partition} LIMIT 1")).first() is not None:
+                    continue
+                db.execute(text(f"DROP TABLE {partition}"))
+        db.execute(catalog.update().where(
+            catalog.c.table_name == table.name, catalog.c.month == month
+        ).values(dropped_at=datetime.datetime.now()))
+        dropped.append(month)
+    return dropped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Raw table partitioning; run by an operator, never at startup.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser(
+        "partition",
+        help="PostgreSQL: rebuild the raw tables not partitioned yet as partitioned by upload month; "
+             "locks each table while it is copied",
+    )
+    sub.add_parser("create-partitions", help="create the partitions of this month and the next ones")
+    args = parser.parse_args(argv)
+
+    import app  # connects to DATABASE_URL and applies the migrations
+
+    if args.command == "partition":
+        if app.engine.dialect.name != "postgresql":
+            parser.error("only PostgreSQL tables are partitioned")
+        partitioned = app.partition_raw_tables()
+        print(f"Partitioned: {', '.join(partitioned) or 'nothing, the raw tables are partitioned already'}")
+    else:
+        db = app.SessionLocal()
+        try:
+            created = app.create_upcoming_partitions(db)
+        finally:
+            db.close()
+        for table_name, months in created.items():
+            print(f"{table_name}: {', '.join(month.isoformat() for month in months) or 'no new partitions'}")
+
+
+if __name__ == "__main__":
+    main()
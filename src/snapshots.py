@@ -0,0 +1,109 @@
+"""
+Compressed, row-addressable report snapshots.
+
+A snapshot's rows are stored in chunks of SNAPSHOT_CHUNK_ROWS rows, each a
+zlib-compressed JSON array, with the position of its first row. A page of a
+snapshot only decompresses the chunks it overlaps, and full reads / filters
+go chunk by chunk, so a snapshot is never held in memory as a whole.
+
+The functions take the chunk table as a parameter:
+    report_id, chunk_no (primary key), first_row, row_count, data
+
+Environment:
+    SNAPSHOT_CHUNK_ROWS     rows per compressed chunk (default 500)
+"""
+import json
+import os
+import zlib
+
+from sqlalchemy import insert, select
+
+SNAPSHOT_CHUNK_ROWS = int(os.getenv("SNAPSHOT_CHUNK_ROWS", "500"))
+COMPRESSION_LEVEL = 6
+
+
+def encode_rows(rows):
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def decode_rows(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def iter_chunks(report_id, rows, chunk_rows=None):
+    """Insert parameters for the chunks of a snapshot."""
+    chunk_rows = chunk_rows or SNAPSHOT_CHUNK_ROWS
+    for chunk_no, first_row in enumerate(range(0, len(rows), chunk_rows)):
+        chunk = rows[first_row:first_row + chunk_rows]
+        yield {
+            "report_id": report_id,
+            "chunk_no": chunk_no,
+            "first_row": first_row,
+            "row_count": len(chunk),
+            "data": encode_rows(chunk),
+        }
+
+
+def write_snapshot(db, chunk_table, report_id, rows, chunk_rows=None, batch_chunks=50):
+    """Store the rows of a snapshot; returns the number of chunks written."""
+    written = 0
+    batch = []
+    for chunk in iter_chunks(report_id, rows, chunk_rows):
+        batch.append(chunk)
+        if len(batch) >= batch_chunks:
+            db.execute(insert(chunk_table), batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(chunk_table), batch)
+        written += len(batch)
+    return written
+
+
+def iter_rows(db, chunk_table, report_id, start=0, stop=None):
+    """Rows start..stop of a snapshot, decompressing one chunk at a time."""
+    query = select(chunk_table.c.first_row, chunk_table.c.data).where(
+        chunk_table.c.report_id == report_id,
+        chunk_table.c.first_row + chunk_table.c.row_count > start,
+    )
+    if stop is not None:
+        query = query.where(chunk_table.c.first_row < stop)
+    query = query.order_by(chunk_table.c.chunk_no).execution_options(yield_per=1)
+    for first_row, data in db.execute(query):
+        rows = decode_rows(data)
+        lo = max(0, start - first_row)
+        hi = len(rows) if stop is None else min(len(rows), stop - first_row)
+        yield from rows[lo:hi]
+
+
+def row_filter(parent_codes=None, project_ranks=None):
+    """Predicate for report rows, or None when nothing is filtered."""
+    if not parent_codes and not project_ranks:
+        return None
+    parent_codes = set(parent_codes or ())
+    project_ranks = set(project_ranks or ())
+
+    def matches(row):
+        return (not parent_codes or row.get("Parent Code") in parent_codes) and (
+            not project_ranks or row.get("Project Rank") in project_ranks
+        )
+    return matches
+
+
+def read_page(db, chunk_table, report_id, row_count, offset=0, limit=None, matches=None):
+    """
+    (rows, total) for one page of a snapshot. Unfiltered pages read only the
+    chunks they overlap; filtered ones scan the snapshot chunk by chunk to
+    count the matches, keeping only the requested page.
+    """
+    if matches is None:
+        stop = None if limit is None else offset + limit
+        return list(iter_rows(db, chunk_table, report_id, offset, stop)), row_count
+    page, total = [], 0
+    for row in iter_rows(db, chunk_table, report_id):
+        if not matches(row):
+            continue
+        if total >= offset and (limit is None or len(page) < limit):
+            page.append(row)
+        total += 1
+    return page, total
@@ -0,0 +1,48 @@
+"""
+Tests run against a throwaway SQLite database unless DATABASE_URL is set,
+e.g. to a scratch PostgreSQL database (the tests empty its tables):
+
+    DATABASE_URL=postgresql://user@host/scratch python -m pytest -q tests
+
+The partitioning tests also create and drop a database named after it
+(scratch_partitioning), so the user needs CREATEDB there.
+"""
+import os
+import sys
+import tempfile
+
+_tmpdir = tempfile.mkdtemp(prefix="dolbix-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmpdir, 'test.db')}?timeout=60")
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+# Jobs run within the submitting request, and compaction archives to the scratch dir
+os.environ.setdefault("JOB_BACKEND", "inline")
+os.environ.setdefault("RAW_ARCHIVE_DIR", os.path.join(_tmpdir, "raw_archive"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import app  # noqa: E402  (DATABASE_URL must be set before the engine is created)
+import benchmark  # noqa: E402
+
+
+@pytest.fixture
+def empty_pipeline():
+    benchmark.reset_pipeline()
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    # One client (and event loop) for the whole session
+    with TestClient(app.app) as client:
+        yield client
+
+
+@pytest.fixture
+def db():
+    session = app.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
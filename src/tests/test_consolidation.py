@@ -0,0 +1,119 @@
+"""
+Incremental consolidation: every upload is folded in once, whatever order
+the uploads commit in relative to consolidation runs.
+"""
+import threading
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+import benchmark
+import report_aggregates
+
+
+def add_upload(db, kind, n, seed=0, upload_id=None, commit=True):
+    """An upload of n synthetic rows (keys 1..n); returns its id."""
+    generate, build_rows, model, columns, upload_type = benchmark.INGEST_TARGETS[kind]
+    upload = app.MonthlyUpload(upload_id=upload_id, upload_type=upload_type, file_name=f"{kind}-{seed}.xlsx")
+    db.add(upload)
+    db.flush()
+    db.refresh(upload)
+    app.bulk_insert(db, model.__table__, build_rows(generate(n, seed), upload), columns)
+    if commit:
+        db.commit()
+    return upload.upload_id
+
+
+def consolidate():
+    db = app.SessionLocal()
+    try:
+        return benchmark.consolidate(db, full_rebuild=False)
+    finally:
+        db.close()
+
+
+def final_keys(db):
+    return (
+        set(db.execute(select(app.CRMProjectFinal.project_id)).scalars()),
+        set(db.execute(select(app.ERPSalesFinal.job_no)).scalars()),
+    )
+
+
+def test_upload_committed_after_a_higher_one_was_consolidated(empty_pipeline, db):
+    # The lower id was allocated first but its rows commit after the run that
+    # consolidated the higher one; explicit ids well above the tests' others
+    add_upload(db, "crm", 50, upload_id=1_000_002)
+    add_upload(db, "erp", 50, upload_id=1_000_003)
+    consolidate()
+    assert final_keys(db) == (set(range(1, 51)), set(range(1, 51)))
+
+    add_upload(db, "crm", 100, seed=1, upload_id=1_000_000)
+    add_upload(db, "erp", 100, seed=1, upload_id=1_000_001)
+    crm, erp = consolidate()
+    assert crm == {"rows": 100, "upload_ids": [1_000_000]} and erp == {"rows": 100, "upload_ids": [1_000_001]}
+    db.expire_all()
+    assert final_keys(db) == (set(range(1, 101)), set(range(1, 101)))
+    assert db.execute(select(func.count()).where(app.MonthlyUpload.consolidated_at.is_(None))).scalar() == 0
+    assert report_aggregates.check(db, app.REPORT_TABLES)["consistent"]
+
+    # Nothing is left to fold in
+    crm, erp = consolidate()
+    assert crm == {"rows": 0, "upload_ids": []} and erp == {"rows": 0, "upload_ids": []}
+
+
+def test_uploads_interleaved_with_a_consolidation_run(empty_pipeline):
+    if app.engine.dialect.name == "sqlite":
+        pytest.skip("SQLite has a single writer: an open upload blocks the other upload")
+    slow, fast = app.SessionLocal(), app.SessionLocal()
+    try:
+        # The slow upload gets the lower id, then the fast one commits and is consolidated
+        slow_id = add_upload(slow, "crm", 100, seed=1, commit=False)
+        fast_id = add_upload(fast, "crm", 50)
+        assert slow_id < fast_id
+        crm, _ = consolidate()
+        assert crm["upload_ids"] == [fast_id]
+        slow.commit()
+
+        crm, _ = consolidate()
+        assert crm["upload_ids"] == [slow_id]
+        assert final_keys(fast)[0] == set(range(1, 101))
+        assert report_aggregates.check(fast, app.REPORT_TABLES)["consistent"]
+    finally:
+        slow.close()
+        fast.close()
+
+
+def consolidate_crm(db, full_rebuild=False):
+    return app.consolidate_upload_type(
+        db, "CRM", app.CRMProjectRaw, app.CRMProjectFinal, "project_id", app.CRM_FINAL_COLUMNS, full_rebuild
+    )
+
+
+def test_concurrent_runs_take_turns(empty_pipeline):
+    if app.engine.dialect.name == "sqlite":
+        pytest.skip("SQLite serializes writers already")
+    first = app.SessionLocal()
+    results = {}
+
+    def second_run():
+        second = app.SessionLocal()
+        try:
+            results["second"] = consolidate_crm(second)
+            second.commit()
+        finally:
+            second.close()
+
+    try:
+        upload_id = add_upload(first, "crm", 10)
+        assert consolidate_crm(first, full_rebuild=True)["upload_ids"] == [upload_id]
+        # An incremental run started meanwhile waits, then finds nothing left to fold in
+        thread = threading.Thread(target=second_run)
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        first.commit()
+        thread.join()
+        assert results["second"] == {"rows": 0, "upload_ids": []}
+    finally:
+        first.close()
@@ -0,0 +1,36 @@
+"""
+The async endpoints hand their database work to the threadpool: while a
+report is being built, the event loop keeps answering other requests.
+"""
+import asyncio
+import threading
+
+import httpx
+
+import app
+
+
+def test_report_build_leaves_the_event_loop_free(empty_pipeline, monkeypatch):
+    building, answered = threading.Event(), threading.Event()
+    served_during_build = []
+
+    def slow_build(db, fiscal_year=None):
+        # Waits for /api/health to be served: on the event loop it never would be
+        building.set()
+        served_during_build.append(answered.wait(timeout=5))
+        return []
+
+    monkeypatch.setitem(app.REPORT_BUILDERS, "sql", slow_build)
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            report = asyncio.create_task(http.post("/api/generate_report", params={"engine": "sql", "refresh": "true"}))
+            await asyncio.to_thread(building.wait, 5)
+            health = await http.get("/api/health")
+            answered.set()
+            return health, await report
+
+    health, report = asyncio.run(requests())
+    assert health.status_code == 200 and served_during_build == [True]
+    assert report.status_code == 200 and report.json()["report"] == []
@@ -0,0 +1,60 @@
+"""
+CSV / XLSX uploads (/api/upload/file/...): files that cannot be read or hold
+no rows are rejected with a 400 before an upload is recorded.
+"""
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+import upload_files
+
+CRM_HEADER = "No,Project name,Company Name,Phase,Order amount (net),Order amount (gross)\n"
+
+
+def post_file(client, upload_type, name, content, **data):
+    return client.post(
+        f"/api/upload/file/{upload_type}",
+        files={"file": (name, content, "application/octet-stream")},
+        data={key: str(value) for key, value in data.items()},
+    )
+
+
+def upload_count():
+    db = app.SessionLocal()
+    try:
+        return db.execute(select(func.count()).select_from(app.MonthlyUpload)).scalar()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("name, content, data", [
+    ("crm.csv", (CRM_HEADER + "1,Café,Edge,A,100,100\n").encode("cp1252"), {}),
+    ("crm.xlsx", b"PK\x03\x04 not a workbook", {}),
+    ("crm.csv", CRM_HEADER.encode(), {}),
+    ("crm.csv", (CRM_HEADER + "1,Edge,Edge,A,100,100\n").encode(), {"skip_rows": 2}),
+])
+def test_unreadable_and_empty_files_are_rejected(empty_pipeline, client, name, content, data):
+    if name.endswith(".xlsx") and upload_files.openpyxl is None:
+        pytest.skip("XLSX uploads need openpyxl")
+    response = post_file(client, "crm", name, content, **data)
+    assert response.status_code == 400, response.text
+    assert upload_count() == 0
+
+
+def test_negative_skip_rows(empty_pipeline, client):
+    response = post_file(client, "crm", "crm.csv", (CRM_HEADER + "1,Edge,Edge,A,100,100\n").encode(), skip_rows=-1)
+    assert response.status_code == 422
+    assert upload_count() == 0
+
+
+def test_crm_amounts_with_thousands_separators(empty_pipeline, client):
+    content = CRM_HEADER + '1,Edge,Edge,A,"1,000","1,234.5"\n'
+    response = post_file(client, "crm", "crm.csv", content.encode())
+    assert response.status_code == 200, response.text
+    db = app.SessionLocal()
+    try:
+        amounts = db.execute(select(app.CRMProjectRaw.order_amount_net, app.CRMProjectRaw.order_amount_gross)).one()
+    finally:
+        db.close()
+    assert tuple(map(float, amounts)) == (1000, 1234.5)
@@ -0,0 +1,64 @@
+"""
+Keyset pages of the read endpoints: every row once, in order, and ETags
+that change with the page's rows, answered with an empty 304 otherwise.
+"""
+import app
+import benchmark
+
+
+def add_crm_upload(client, n, seed=0):
+    records = [record.model_dump(by_alias=True) for record in benchmark.synthetic_crm_records(n, seed)]
+    response = client.post("/api/upload/crm", json={"file_name": "crm.xlsx", "month": "April", "records": records})
+    response.raise_for_status()
+    return response.json()["upload_id"]
+
+
+def test_pages_return_every_row_once(empty_pipeline, client):
+    upload_id = add_crm_upload(client, 45)
+    add_crm_upload(client, 10, seed=1)
+    url, seen = f"/api/uploads/crm/{upload_id}/rows?limit=20&fields=project_id", []
+    while url:
+        response = client.get(url)
+        response.raise_for_status()
+        assert all(set(row) == {"id", "project_id"} for row in response.json())
+        seen += [row["project_id"] for row in response.json()]
+        link = response.headers.get("link")
+        url = link[1:link.index(">")] if link else None
+    assert seen == list(range(1, 46))
+
+
+def test_etag_follows_the_page_rows(empty_pipeline, client):
+    first_id = add_crm_upload(client, 30)
+    url = f"/api/uploads/crm/{first_id}/rows?limit=20"
+    page = client.get(url)
+    tag = page.headers["etag"]
+    assert tag.startswith('W/"')
+
+    unchanged = client.get(url, headers={"If-None-Match": tag})
+    assert unchanged.status_code == 304 and not unchanged.content and unchanged.headers["etag"] == tag
+    assert client.get(url, headers={"If-None-Match": tag.removeprefix("W/")}).status_code == 304
+    # Another projection of the same rows is another representation
+    assert client.get(f"{url}&fields=project_id", headers={"If-None-Match": tag}).status_code == 200
+
+    # New uploads change the upload listings; deleted rows change the pages they were on
+    uploads = client.get("/api/uploads/crm")
+    add_crm_upload(client, 5, seed=1)
+    assert client.get("/api/uploads/crm", headers={"If-None-Match": uploads.headers["etag"]}).status_code == 200
+    db = app.SessionLocal()
+    try:
+        db.execute(app.CRMProjectRaw.__table__.delete().where(app.CRMProjectRaw.project_id == 3))
+        db.commit()
+    finally:
+        db.close()
+    changed = client.get(url, headers={"If-None-Match": tag})
+    assert changed.status_code == 200 and changed.headers["etag"] != tag
+    assert 3 not in [row["project_id"] for row in changed.json()]
+
+
+def test_latest_uploads_etag_changes_with_a_new_upload(empty_pipeline, client):
+    add_crm_upload(client, 10)
+    latest = client.get("/api/latest_uploads", params={"limit": 5})
+    assert latest.json()["erp"] is None
+    assert client.get("/api/latest_uploads", params={"limit": 5}, headers={"If-None-Match": latest.headers["etag"]}).status_code == 304
+    add_crm_upload(client, 10, seed=1)
+    assert client.get("/api/latest_uploads", params={"limit": 5}, headers={"If-None-Match": latest.headers["etag"]}).status_code == 200
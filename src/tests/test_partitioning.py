@@ -0,0 +1,111 @@
+"""
+Partitioning the raw tables of a PostgreSQL database that has rows already
+(python retention.py partition), and adding months to it afterwards. Runs on
+a scratch database created next to DATABASE_URL's.
+"""
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+import app
+import benchmark
+import migrations
+import retention
+
+SEEDED_MONTHS = 3
+
+
+@pytest.fixture(scope="module")
+def scratch_engine():
+    if app.engine.dialect.name != "postgresql":
+        pytest.skip("only PostgreSQL tables are partitioned")
+    url = make_url(app.DATABASE_URL)
+    name = f"{url.database}_partitioning"
+    with app.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{name}"'))
+        connection.execute(text(f'CREATE DATABASE "{name}"'))
+    engine = create_engine(url.set(database=name))
+    try:
+        migrations.migrate(engine, app.Base.metadata)
+        yield engine
+    finally:
+        engine.dispose()
+        with app.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text(f'DROP DATABASE IF EXISTS "{name}"'))
+
+
+def add_upload(db, kind, n, timestamp):
+    """An upload stored as the upload endpoints store it, dated `timestamp`."""
+    generate, build_rows, model, columns, upload_type = benchmark.INGEST_TARGETS[kind]
+    upload = app.create_upload(db, upload_type, f"{kind}.xlsx", commit=False)
+    upload.upload_timestamp = timestamp
+    retention.register_month(db, app.RawTablePartition.__table__, model.__table__, timestamp)
+    app.bulk_insert(db, model.__table__, build_rows(generate(n, timestamp.month), upload), columns)
+    db.commit()
+
+
+def row_counts(db, relation):
+    return db.execute(text(f"SELECT count(*) FROM {relation}")).scalar()
+
+
+def raw_tables():
+    return [raw_model.__table__ for raw_model, _, _ in app.RAW_TABLES.values()]
+
+
+def test_partition_raw_tables_with_rows(scratch_engine):
+    this_month = retention.month_start(datetime.date.today())
+    seeded = [retention.months_before(this_month, ago) for ago in range(SEEDED_MONTHS - 1, -1, -1)]
+    upcoming = retention.next_month(this_month)
+    with Session(scratch_engine) as db:
+        for month in seeded:
+            for kind in benchmark.INGEST_TARGETS:
+                add_upload(db, kind, 40, datetime.datetime.combine(month, datetime.time(9)))
+        before = {table.name: row_counts(db, table.name) for table in raw_tables()}
+        assert not any(retention.is_partitioned(db, table) for table in raw_tables())
+
+    assert app.partition_raw_tables(scratch_engine) == [table.name for table in raw_tables()]
+    assert app.partition_raw_tables(scratch_engine) == []
+
+    catalog = app.RawTablePartition.__table__
+    with Session(scratch_engine) as db:
+        for table in raw_tables():
+            assert retention.is_partitioned(db, table)
+            assert row_counts(db, table.name) == before[table.name]
+            for month in seeded:
+                assert row_counts(db, retention.partition_name(table, month)) == before[table.name] // SEEDED_MONTHS
+            assert row_counts(db, retention.partition_name(table, upcoming)) == 0
+            assert row_counts(db, f"{table.name}_pdefault") == 0
+            assert set(db.execute(select(catalog.c.month).where(catalog.c.table_name == table.name)).scalars()) == {
+                *seeded, upcoming
+            }
+        # The partitioned tables take uploads and consolidation as before
+        add_upload(db, "crm", 10, datetime.datetime.now())
+        app.consolidate_all(db)
+        db.commit()
+        assert db.execute(select(func.count()).select_from(app.CRMProjectFinal)).scalar() == 40
+        assert app.create_upcoming_partitions(db) == {table.name: [] for table in raw_tables()}
+
+
+def test_uploads_without_their_partition_are_moved_into_it(scratch_engine):
+    # A month nobody created the partition of: the upload's rows land in the default partition
+    month = retention.months_before(retention.month_start(datetime.date.today()), -6)
+    table = app.ERPSalesRaw.__table__
+    with Session(scratch_engine) as db:
+        add_upload(db, "erp", 25, datetime.datetime.combine(month, datetime.time(9)))
+        total = row_counts(db, table.name)
+        assert row_counts(db, f"{table.name}_pdefault") == 25
+
+        assert retention.ensure_partitions(db, app.RawTablePartition.__table__, table, [month]) == [month]
+        db.commit()
+        assert row_counts(db, retention.partition_name(table, month)) == 25
+        assert row_counts(db, f"{table.name}_pdefault") == 0
+        assert row_counts(db, table.name) == total
+        # The attached partition has the table's indexes
+        indexes = set(db.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :name"),
+            {"name": retention.partition_name(table, month)},
+        ).scalars())
+        assert len(indexes) == len(table.indexes) + 1
@@ -0,0 +1,34 @@
+"""
+The pipeline's statement counts against the committed benchmark baseline of
+the test database's dialect (data/pipeline_baseline_<dialect>.json). Wall
+time and memory depend on the machine and are only checked by the benchmark.
+After an intended change, re-save the baseline:
+
+    python benchmark.py pipeline --save tests/data/pipeline_baseline_sqlite.json
+"""
+import json
+import math
+import os
+
+import pytest
+
+import app
+import benchmark
+
+SCALE = "1000"
+
+
+def test_pipeline_statements_within_baseline(client):
+    path = os.path.join(os.path.dirname(__file__), "data", f"pipeline_baseline_{app.engine.dialect.name}.json")
+    if not os.path.exists(path):
+        pytest.skip(f"no pipeline baseline for {app.engine.dialect.name}")
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    measured = benchmark.run_pipeline(client, benchmark.pipeline_payloads(int(SCALE)), baseline["engine"])
+    assert set(measured) == set(baseline["scales"][SCALE])
+    # Infinite tolerances: only the statement counts are compared
+    regressions = benchmark.pipeline_regressions(
+        {"scales": {SCALE: measured}}, baseline, math.inf, math.inf, math.inf
+    )
+    assert not regressions
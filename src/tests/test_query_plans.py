@@ -0,0 +1,115 @@
+"""
+Query plan regression checks: the consolidation, report and read API
+queries must be planned through their indexes, so a dropped or renamed
+index fails here instead of as a slow endpoint in production.
+"""
+import re
+
+import pytest
+from sqlalchemy import func, select
+
+import app
+import benchmark
+import pagination
+from consolidation import latest_rows
+from report_sql import eligible_crm_query, erp_monthly_query
+
+# Enough rows that the planner prefers the indexes to scanning the tables
+PLAN_PROJECTS = 5_000
+
+
+def explain(db, statement):
+    """
+    The database's plan for a statement, as one string (SQLite or
+    PostgreSQL). PostgreSQL rightly scans test-sized tables, so it is told
+    to use an index wherever one can serve the query.
+    """
+    dialect = db.get_bind().dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if dialect.name == "sqlite" else "EXPLAIN "
+    if dialect.name == "postgresql":
+        db.connection().exec_driver_sql("SET LOCAL enable_seqscan = off")
+    return "\n".join(" ".join(str(v) for v in row) for row in db.connection().exec_driver_sql(prefix + sql))
+
+
+def uses_index(plan, name):
+    """Whether the plan uses the named index, or its copy on a partition of a partitioned raw table."""
+    if name in plan:
+        return True
+    for table in (app.CRMProjectRaw.__tablename__, app.ERPSalesRaw.__tablename__, app.DataCodeRaw.__tablename__):
+        if name.startswith(f"ix_{table}_"):
+            columns = name.removeprefix(f"ix_{table}_")
+            return re.search(rf"\b{table}_p[0-9a-z]+_{columns}_idx\b", plan) is not None
+    return False
+
+
+def plan_checks(newest):
+    """(label, statement, index groups): the plan must use at least one index of every group."""
+    crm_raw, erp_raw = app.CRMProjectRaw.__table__, app.ERPSalesRaw.__table__
+    crm, erp, datacode = app.CRMProjectFinal.__table__, app.ERPSalesFinal.__table__, app.DataCodeRaw.__table__
+    crm_by_upload, crm_by_key = "ix_crm_projects_raw_upload_id_project_id", "ix_crm_projects_raw_project_id_id"
+    erp_by_upload, erp_by_key = "ix_erp_sales_raw_upload_id_job_no", "ix_erp_sales_raw_job_no_id"
+    # Either index on upload_id serves the keys of one upload
+    crm_upload_ids = {crm_by_upload, "ix_crm_projects_raw_upload_id_id"}
+    erp_upload_ids = {erp_by_upload, "ix_erp_sales_raw_upload_id_id"}
+    return [
+        ("consolidate: latest CRM rows of one upload",
+         latest_rows(crm_raw, "project_id", app.CRM_FINAL_COLUMNS, [newest]), [crm_upload_ids, {crm_by_key}]),
+        ("consolidate: latest ERP rows of one upload",
+         latest_rows(erp_raw, "job_no", app.ERP_FINAL_COLUMNS, [newest]), [erp_upload_ids, {erp_by_key}]),
+        ("consolidate: latest CRM rows, full rebuild",
+         latest_rows(crm_raw, "project_id", app.CRM_FINAL_COLUMNS), [{crm_by_key}]),
+        ("consolidate: latest ERP rows, full rebuild",
+         latest_rows(erp_raw, "job_no", app.ERP_FINAL_COLUMNS), [{erp_by_key}]),
+        ("report: ERP monthly pivot", erp_monthly_query(erp, crm, datacode),
+         [{"ix_data_code_raw_project_name_id"}, {"ix_crm_projects_final_project_name_project_id"}]),
+        ("report: eligible CRM projects", eligible_crm_query(crm, datacode), [{"ix_data_code_raw_project_name_id"}]),
+        ("report: fiscal year ERP rows",
+         select(erp).where(*app.erp_fiscal_year_criteria(2024)), [{"ix_erp_sales_final_sales_date"}]),
+        ("report: aggregate rows in report order",
+         select(app.REPORT_TABLES.aggregates).order_by(
+             app.REPORT_TABLES.aggregates.c.section, app.REPORT_TABLES.aggregates.c.project_no),
+         [{"ix_report_project_aggregates_section_project_no"}]),
+        ("api: page of an upload's raw rows",
+         select(crm_raw).where(crm_raw.c.upload_id == newest - 1, crm_raw.c.id > 0).order_by(crm_raw.c.id).limit(101),
+         [{"ix_crm_projects_raw_upload_id_id"}]),
+        ("api: ETag of a page of an upload's raw rows",
+         pagination.window_version_query(
+             dict(crm_raw.columns.items()), "id", (crm_raw.c.upload_id == newest - 1,), after=0
+         ),
+         [{"ix_crm_projects_raw_upload_id_id"}]),
+    ]
+
+
+@pytest.fixture(scope="module")
+def newest_upload_id():
+    """Seeded and analyzed tables, with a second upload per raw table so the
+    incremental queries select one upload out of several."""
+    benchmark.reset_pipeline()
+    benchmark.seed_final_tables(PLAN_PROJECTS)
+    db = app.SessionLocal()
+    try:
+        for kind in ("crm", "erp"):
+            generate, build_rows, model, columns, upload_type = benchmark.INGEST_TARGETS[kind]
+            upload = app.create_upload(db, upload_type, f"seed-{kind}-2.xlsx")
+            app.bulk_insert(db, model.__table__, build_rows(generate(PLAN_PROJECTS // 10, seed=1), upload), columns)
+        db.commit()
+        if app.engine.dialect.name == "postgresql":
+            # VACUUM also sets the visibility map autovacuum keeps up to date, without which a
+            # new table gets no index-only scans; it cannot run inside a transaction
+            with app.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.exec_driver_sql("VACUUM ANALYZE")
+        else:
+            db.connection().exec_driver_sql("ANALYZE")
+            db.commit()
+        return db.execute(select(func.max(app.MonthlyUpload.upload_id))).scalar()
+    finally:
+        db.close()
+
+
+@pytest.mark.parametrize("check", range(len(plan_checks(2))), ids=[label for label, _, _ in plan_checks(2)])
+def test_query_uses_its_indexes(newest_upload_id, db, check):
+    label, statement, groups = plan_checks(newest_upload_id)[check]
+    plan = explain(db, statement)
+    missing = [" or ".join(sorted(group)) for group in groups if not any(uses_index(plan, name) for name in group)]
+    assert not missing, f"{label} no longer uses {' / '.join(missing)}:\n{plan}"
@@ -0,0 +1,151 @@
+"""
+The all-years report defaults to the aggregate table, which every write
+path keeps up to date incrementally. After each of them the table must
+match a full recompute and give the row-based report's rows.
+"""
+import csv
+import datetime
+import io
+
+from sqlalchemy import update
+
+import app
+import benchmark
+import report_aggregates
+
+
+def assert_aggregates_current(client, step):
+    check = client.get("/api/report_aggregates/check").json()
+    assert check["consistent"], f"after {step}: {check}"
+    db = app.SessionLocal()
+    try:
+        assert report_aggregates.read_report(db, app.REPORT_TABLES) == app.REPORT_BUILDERS["python"](db, None), step
+    finally:
+        db.close()
+
+
+def upload_json(client, kind, records):
+    path = {"crm": "/api/upload/crm", "erp": "/api/upload/erp/sales", "datacode": "/api/upload/datacode"}[kind]
+    response = client.post(path, json={"file_name": f"{kind}.xlsx", "month": "April", "records": records})
+    response.raise_for_status()
+    return response.json()
+
+
+def upload_csv(client, upload_type, records):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(records[0]))
+    writer.writeheader()
+    writer.writerows(records)
+    response = client.post(
+        f"/api/upload/file/{upload_type}",
+        files={"file": (f"{upload_type}.csv", out.getvalue().encode("utf-8"), "text/csv")},
+        data={"skip_rows": "0"},
+    )
+    response.raise_for_status()
+
+
+def run_job(client, path, **params):
+    response = client.post(path, params=params)
+    response.raise_for_status()
+    job = client.get(f"/api/jobs/{response.json()['job_id']}").json()
+    assert job["status"] == "succeeded", job
+    return job["result"]
+
+
+def test_every_write_path_keeps_aggregates_current(empty_pipeline, client):
+    records = benchmark.pipeline_records(200)
+    later = benchmark.pipeline_records(200, seed=1)
+    renamed = [{**record, "Project name": f"Renamed {record['No']}"} for record in records["crm"][:50]]
+    steps = [
+        ("CRM upload", lambda: upload_json(client, "crm", records["crm"])),
+        ("ERP upload", lambda: upload_json(client, "erp", records["erp"])),
+        ("consolidation", lambda: client.post("/api/consolidate").raise_for_status()),
+        # The first mapping of a project name wins: each DataCode upload maps further projects
+        ("DataCode upload", lambda: upload_json(client, "datacode", records["datacode"][:100])),
+        # ERP jobs take their rank from the CRM project named like them, before and after
+        ("renaming CRM projects", lambda: (
+            upload_json(client, "crm", renamed), client.post("/api/consolidate").raise_for_status()
+        )),
+        ("a repeated upload", lambda: (
+            upload_json(client, "crm", renamed), client.post("/api/consolidate").raise_for_status()
+        )),
+        ("DataCode file upload", lambda: upload_csv(client, "datacode", records["datacode"][100:])),
+        ("CRM and ERP file uploads and a consolidation job", lambda: (
+            upload_csv(client, "crm", later["crm"][100:]),
+            upload_csv(client, "erp_sales", later["erp"][:60]),
+            run_job(client, "/api/jobs/consolidate"),
+        )),
+        ("a full rebuild job", lambda: run_job(client, "/api/jobs/consolidate", full_rebuild="true")),
+        ("compaction", lambda: compact_everything(client)),
+        ("an upload after compaction", lambda: (
+            upload_json(client, "erp", later["erp"][60:]), client.post("/api/consolidate").raise_for_status()
+        )),
+    ]
+    for step, write in steps:
+        write()
+        assert_aggregates_current(client, step)
+
+
+def compact_everything(client):
+    """Date every upload a year back, then compact them all."""
+    db = app.SessionLocal()
+    try:
+        db.execute(update(app.MonthlyUpload).values(
+            upload_timestamp=datetime.datetime.now() - datetime.timedelta(days=365)
+        ))
+        db.commit()
+    finally:
+        db.close()
+    result = run_job(client, "/api/jobs/compact_raw", retention_months=1)
+    assert result["tables"][app.CRMProjectRaw.__tablename__]["archived_rows"]
+
+
+def test_check_is_read_only_and_repair_rebuilds(empty_pipeline, client):
+    records = benchmark.pipeline_records(50)
+    upload_json(client, "crm", records["crm"])
+    upload_json(client, "erp", records["erp"])
+    client.post("/api/consolidate").raise_for_status()
+    db = app.SessionLocal()
+    try:
+        db.execute(update(app.ReportProjectAggregate).values(net_sales=-1))
+        db.commit()
+    finally:
+        db.close()
+
+    for _ in range(2):
+        check = client.get("/api/report_aggregates/check").json()
+        assert not check["consistent"] and check["mismatched"]
+    repair = client.post("/api/report_aggregates/repair").json()
+    assert repair["repaired"] and repair["mismatched"] == check["mismatched"]
+    assert client.get("/api/report_aggregates/check").json()["consistent"]
+    assert client.post("/api/report_aggregates/repair").json()["repaired"] is False
+
+
+def test_projects_without_a_name(empty_pipeline, client):
+    # An ERP job without a project name takes the rank of the last CRM project without one
+    def unnamed_project(number, phase):
+        return {"No": number, "Company Name": "Unnamed", "Phase": phase, "high potential mark": "〇",
+                "Order amount (net)": 1, "Contract start date": "05/01/24", "Contract End Date": "10/01/24",
+                "Billing method (number of times)": 2}
+
+    steps = [
+        ("CRM and ERP uploads without names", lambda: (
+            upload_json(client, "crm", [unnamed_project(10, "B")]),
+            upload_json(client, "erp", [{"JOB No.": "20", "Client name": "Unnamed", "Operating profit": "4",
+                                         "Sales posting date": "24/08/08"}]),
+            client.post("/api/consolidate").raise_for_status(),
+        )),
+        ("a later CRM project without a name", lambda: (
+            upload_json(client, "crm", [unnamed_project(11, "A")]), client.post("/api/consolidate").raise_for_status()
+        )),
+        ("naming it", lambda: (
+            upload_json(client, "crm", [{**unnamed_project(11, "A"), "Project name": "Named"}]),
+            client.post("/api/consolidate").raise_for_status(),
+        )),
+    ]
+    ranks = []
+    for step, write in steps:
+        write()
+        assert_aggregates_current(client, step)
+        ranks.append(client.post("/api/generate_report").json()["report"][0]["Project Rank"])
+    assert ranks == ["B", "A", "B"]
@@ -0,0 +1,136 @@
+"""
+Golden-output checks of the report engines. The row-based
+create_performance_report is the reference: its output on the edge-case
+rows is pinned in data/report_edge_cases.json, and every other engine must
+return exactly its rows, in memory and on a small database filled through
+the upload API.
+"""
+import json
+import os
+
+import pytest
+
+import app
+import benchmark
+import report
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "data", "report_edge_cases.json")
+FISCAL_YEARS = (None,) + benchmark.CHECK_FISCAL_YEARS
+
+# Uploaded on top of the synthetic projects: blank, missing and lower-case
+# phases, missing dates, amounts and project names, a contract ending before
+# it starts, and a second upload overriding a project and a job
+EDGE_CRM_RECORDS = [
+    {"No": 90001, "Project name": "Blank phase", "Company Name": "Edge", "Phase": "   ", "high potential mark": "〇",
+     "Order amount (net)": 3, "Contract start date": "04/01/24", "Contract End Date": "09/30/24",
+     "Billing method (number of times)": 2},
+    {"No": 90002, "Project name": "No phase", "Company Name": "Edge", "high potential mark": "〇",
+     "Order amount (net)": 4, "Contract start date": "02/01/24", "Contract End Date": "12/01/24",
+     "Billing method (number of times)": 2},
+    {"No": 90003, "Project name": "Lower sa", "Company Name": "Edge", "Phase": " sa ", "high potential mark": "〇",
+     "Order amount (net)": 2, "Contract start date": "01/01/24", "Contract End Date": "06/01/24",
+     "Billing method (number of times)": 3},
+    {"No": 90004, "Project name": "No dates", "Company Name": "Edge", "Phase": "A", "high potential mark": "〇",
+     "Order amount (net)": 1, "Billing method (number of times)": 2},
+    {"No": 90005, "Project name": "Backwards", "Company Name": "Edge", "Phase": "B", "high potential mark": "〇",
+     "Order amount (net)": 1, "Contract start date": "09/01/24", "Contract End Date": "06/01/24",
+     "Billing method (number of times)": 0},
+    {"No": 90008, "Company Name": "Edge", "Phase": "A", "high potential mark": "〇",
+     "Order amount (net)": 2, "Contract start date": "05/01/24", "Contract End Date": "10/01/24",
+     "Billing method (number of times)": 2},
+]
+EDGE_ERP_RECORDS = [
+    {"JOB No.": "90001", "Client name": "Edge", "Project name": "Blank phase", "Operating profit": "1,500",
+     "Sales posting date": "24/05/02"},
+    {"JOB No.": "90006", "Client name": "Edge", "Project name": "No date", "Operating profit": "7"},
+    {"JOB No.": "90007", "Client name": "Edge", "Project name": "No profit", "Sales posting date": "25/03/03"},
+    {"JOB No.": "90009", "Client name": "Edge", "Operating profit": "4", "Sales posting date": "24/08/08"},
+]
+EDGE_DATACODE_RECORDS = [
+    {"Customer Name": "Edge", "Project name": "Blank phase", "Parent Code": "PA"},
+    {"Customer Name": "Edge", "Project name": "Blank phase", "Parent Code": "PB"},
+    {"Customer Name": "Edge", "Project name": "Lower sa"},
+]
+SECOND_CRM_RECORDS = [
+    {"No": 90002, "Project name": "No phase renamed", "Company Name": "Edge", "Phase": "C", "high potential mark": "〇",
+     "Order amount (net)": 6, "Contract start date": "03/01/24", "Contract End Date": "03/01/25",
+     "Billing method (number of times)": 4},
+]
+SECOND_ERP_RECORDS = [
+    {"JOB No.": "90006", "Client name": "Edge", "Project name": "No date", "Operating profit": "9",
+     "Sales posting date": "24/11/11"},
+]
+
+
+def assert_same_rows(rows, golden):
+    assert rows == golden
+    # repr also catches 0 vs 0.0 in untouched month cells
+    assert repr(rows) == repr(golden)
+
+
+def upload(client, kind, records):
+    path = {"crm": "/api/upload/crm", "erp": "/api/upload/erp/sales", "datacode": "/api/upload/datacode"}[kind]
+    response = client.post(path, json={"file_name": f"{kind}.xlsx", "month": "April", "records": records})
+    response.raise_for_status()
+
+
+@pytest.mark.parametrize("phase", [None, "", "   "])
+def test_missing_or_blank_phase_ranks_e(phase):
+    assert report.extract_project_rank(phase) == "E"
+
+
+@pytest.mark.parametrize("fiscal_year", FISCAL_YEARS)
+def test_row_based_report_matches_golden_file(fiscal_year):
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)[str(fiscal_year)]
+    rows = app.create_performance_report(*benchmark.edge_case_report_inputs(), fiscal_year=fiscal_year)
+    assert_same_rows(rows, golden)
+
+
+@pytest.mark.parametrize("fiscal_year", FISCAL_YEARS)
+@pytest.mark.parametrize(
+    "inputs", [benchmark.edge_case_report_inputs(), benchmark.synthetic_report_inputs(300)],
+    ids=["edge cases", "synthetic"],
+)
+def test_columnar_report_matches_row_based(inputs, fiscal_year):
+    if app.report_columnar is None:
+        pytest.skip("the columnar engine needs pandas and NumPy")
+    golden = app.create_performance_report(*inputs, fiscal_year=fiscal_year)
+    assert_same_rows(app.report_columnar.create_performance_report_columnar(*inputs, fiscal_year=fiscal_year), golden)
+
+
+@pytest.fixture(scope="module")
+def uploaded_database(client):
+    """Two rounds of uploads and incremental consolidation through the API."""
+    benchmark.reset_pipeline()
+    records = benchmark.pipeline_records(300)
+    upload(client, "crm", records["crm"] + EDGE_CRM_RECORDS)
+    upload(client, "erp", records["erp"] + EDGE_ERP_RECORDS)
+    upload(client, "datacode", records["datacode"] + EDGE_DATACODE_RECORDS)
+    client.post("/api/consolidate").raise_for_status()
+    upload(client, "crm", SECOND_CRM_RECORDS)
+    upload(client, "erp", SECOND_ERP_RECORDS)
+    client.post("/api/consolidate").raise_for_status()
+
+
+@pytest.mark.parametrize("fiscal_year", FISCAL_YEARS)
+@pytest.mark.parametrize("engine", [engine for engine in app.REPORT_BUILDERS if engine != "python"])
+def test_database_engines_match_row_based(uploaded_database, db, engine, fiscal_year):
+    if engine == "columnar" and app.report_columnar is None:
+        pytest.skip("the columnar engine needs pandas and NumPy")
+    if engine == "aggregate" and fiscal_year is not None:
+        pytest.skip("the aggregate table only holds the all-years report")
+    golden = app.REPORT_BUILDERS["python"](db, fiscal_year)
+    assert golden
+    assert_same_rows(app.REPORT_BUILDERS[engine](db, fiscal_year), golden)
+
+
+def test_database_report_includes_edge_projects(uploaded_database, db):
+    rows = {row["Project Code"]: row for row in app.REPORT_BUILDERS["python"](db, None)}
+    assert rows["0090001"]["Project Rank"] == "E"
+    # The first DataCode row of a name gives its parent code
+    assert rows["0090001"]["Parent Code"] == "PA"
+    assert rows["0090006"]["November"] == 9
+    # A job without a name is ranked like the last CRM project without one (DataCode rows have names)
+    assert rows["0090009"]["Project Name"] is None
+    assert (rows["0090009"]["Project Rank"], rows["0090009"]["Parent Code"]) == ("A", "")
@@ -0,0 +1,108 @@
+"""
+Row-by-row readers for uploaded CSV / XLSX files.
+
+Both readers yield one dict per data row keyed by the header cells, with every
+value as text (or None for empty cells), i.e. the same shape the frontend
+produces with XLSX.utils.sheet_to_json(..., {raw: false}). The file is never
+loaded as a whole: CSV is decoded incrementally and XLSX is opened read-only,
+so memory stays flat regardless of the file size.
+"""
+import csv
+import datetime
+import io
+import os
+import zipfile
+
+try:
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+except ImportError:  # openpyxl is optional; only .xlsx uploads need it
+    openpyxl = None
+
+CSV_EXTENSIONS = (".csv",)
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+
+
+class UnreadableFileError(ValueError):
+    """The upload is not UTF-8 CSV text or not an XLSX workbook (raised while reading it)."""
+
+
+def file_format(filename):
+    """'csv' or 'xlsx' from the file extension, None when unsupported."""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension in CSV_EXTENSIONS:
+        return "csv"
+    if extension in XLSX_EXTENSIONS:
+        return "xlsx"
+    return None
+
+
+def _cell_text(value, date_format):
+    if value is None:
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime(date_format)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    text = str(value).strip()
+    return text or None
+
+
+def _rows_from_cells(rows, skip_rows, date_format):
+    """Turn an iterator of cell tuples into header-keyed dicts, dropping blank rows."""
+    for _ in range(skip_rows):
+        if next(rows, None) is None:
+            return
+    header = next(rows, None)
+    if header is None:
+        return
+    keys = [_cell_text(cell, date_format) for cell in header]
+    for cells in rows:
+        record = {}
+        for key, cell in zip(keys, cells):
+            value = _cell_text(cell, date_format)
+            if key is not None and value is not None:
+                record[key] = value
+        if record:
+            yield record
+
+
+def iter_csv_records(fileobj, skip_rows=0, date_format="%m/%d/%y", encoding="utf-8-sig"):
+    """Stream records from a binary CSV file object."""
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+    try:
+        yield from _rows_from_cells(csv.reader(text), skip_rows, date_format)
+    except UnicodeDecodeError as e:
+        raise UnreadableFileError(f"The CSV file cannot be decoded ({e}). Save it as CSV UTF-8.") from e
+    except csv.Error as e:
+        raise UnreadableFileError(f"The CSV file cannot be read: {e}") from e
+    finally:
+        # Leave the underlying upload file open for its owner
+        if not text.closed:
+            text.detach()
+
+
+def iter_xlsx_records(fileobj, skip_rows=0, date_format="%m/%d/%y"):
+    """Stream records from the first worksheet of a binary XLSX file object."""
+    try:
+        workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+        # KeyError: a zip archive without the workbook parts
+        raise UnreadableFileError(f"The file is not an XLSX workbook: {e}") from e
+    try:
+        sheet = workbook.worksheets[0]
+        yield from _rows_from_cells(sheet.iter_rows(values_only=True), skip_rows, date_format)
+    finally:
+        workbook.close()
+
+
+def iter_file_records(fileobj, filename, skip_rows=0, date_format="%m/%d/%y"):
+    """Dispatch on the file extension; raises ValueError for unsupported files."""
+    kind = file_format(filename)
+    if kind == "csv":
+        return iter_csv_records(fileobj, skip_rows, date_format)
+    if kind == "xlsx":
+        if openpyxl is None:
+            raise ValueError("XLSX uploads require openpyxl to be installed.")
+        return iter_xlsx_records(fileobj, skip_rows, date_format)
+    raise ValueError(f"Unsupported file type '{filename}'. Expected .csv or .xlsx.")